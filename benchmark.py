@@ -0,0 +1,596 @@
+# Benchmarks for scheduler.py on synthetic data
+
+# How to use:
+# 1. python benchmark.py --mentors 1000 --sites 100
+#    (times every phase and prints the results as JSON)
+# 2. python benchmark.py --mentors 10 100 1000 10000 --sites 10 1000 --output bench.json
+#    (runs every combination and also writes the results to bench.json)
+# 3. --memory also records the peak traced memory of every phase (phases
+#    run slower while tracing), --workers sets the read() worker count and
+#    --keep DIR keeps the generated corpus in DIR
+# 4. python benchmark.py --mentors 20 --export-events 3000 --no-xlsx
+#    (Google-style calendars become large exports; compare the csvScan and
+#    parseEvents phases)
+# 5. python benchmark.py --check-teams 500
+#    (compares coverTeams() with a brute-force search on 500 random cases
+#    and exits with status 1 if any disagree; --team-headcount N sets the
+#    headcount of the findTeams phase)
+#    python benchmark.py --check-assign 400
+#    (compares assign() with a Bellman-Ford min-cost flow on 400 random
+#    cases) and python benchmark.py --check-occurrences 20000 (compares
+#    occurrenceWeeks() with a naive expansion); the checks can be combined
+# From Python: benchmark.runBenchmark(1000, 100) returns the same dictionary
+
+import argparse
+import csv
+import json
+import random
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from itertools import combinations
+from os import listdir, makedirs, sep
+from time import perf_counter, process_time
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+import scheduler
+
+weekdayCodes = ["MO", "TU", "WE", "TH", "FR"]
+termStart = date(2017, 8, 28) # Monday of the first week of the Regular term
+termEnd = "20171208T235959"
+
+def stamp(day, seconds):
+    # Inputs: date and seconds after midnight
+    # Outputs: iCal local date-time, e.g. "20170828T103000"
+    return "%sT%02d%02d%02d" % (day.strftime("%Y%m%d"), seconds // 3600,
+                                seconds // 60 % 60, seconds % 60)
+
+def randomMeeting(rng):
+    # Outputs: (start, end) seconds after midnight of a class-like meeting
+    start = rng.randrange(8 * 3600, 20 * 3600, 1800)
+    return start, start + rng.choice([50, 80, 110, 170]) * 60
+
+def sioCalendar(rng, courseCount):
+    # Outputs: text of an SIO-style iCal: weekly courses that run through
+    # the whole term or one mini, with UNTIL
+    lines = ["BEGIN:VCALENDAR", "PRODID:-CMU SIO//Schedule//EN", "VERSION:2.0"]
+    for course in range(courseCount):
+        days = sorted(rng.sample(range(5), rng.choice([1, 2, 2, 3])))
+        start, end = randomMeeting(rng)
+        first = termStart + timedelta(days=days[0])
+        mini = rng.random()
+        if mini < 0.15: # Mini-2
+            first += timedelta(weeks=8)
+        until = "20171013T235959" if 0.15 <= mini < 0.3 else termEnd
+        lines += ["BEGIN:VEVENT",
+                  "SUMMARY:%02d-%03d" % (rng.randrange(1, 99), rng.randrange(1000)),
+                  "DTSTART:" + stamp(first, start),
+                  "DTEND:" + stamp(first, end),
+                  "RRULE:FREQ=WEEKLY;UNTIL=%s;BYDAY=%s" % (
+                      until, ",".join(weekdayCodes[day] for day in days)),
+                  "LOCATION:Building %d" % rng.randrange(100),
+                  "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+def googleCalendar(rng, eventCount):
+    # Outputs: text of a Google/Outlook-style iCal: TZID times, alarms,
+    # COUNT and open-ended recurrences, one-off and all-day events, Zulu
+    # times and folded description lines
+    lines = ["BEGIN:VCALENDAR", "PRODID:-//Google Inc//Google Calendar 70.9054//EN",
+             "VERSION:2.0", "CALSCALE:GREGORIAN", "X-WR-TIMEZONE:America/New_York",
+             "BEGIN:VTIMEZONE", "TZID:America/New_York", "BEGIN:STANDARD",
+             "DTSTART:19701101T020000", "TZOFFSETFROM:-0400", "TZOFFSETTO:-0500",
+             "END:STANDARD", "END:VTIMEZONE"]
+    for event in range(eventCount):
+        kind = rng.random()
+        first = termStart + timedelta(days=rng.randrange(70))
+        lines.append("BEGIN:VEVENT")
+        if kind < 0.1: # All-day event
+            lines += ["DTSTART;VALUE=DATE:" + first.strftime("%Y%m%d"),
+                      "DTEND;VALUE=DATE:" + (first + timedelta(days=1)).strftime("%Y%m%d")]
+        else:
+            start, end = randomMeeting(rng)
+            if kind < 0.15: # Zulu time
+                lines += ["DTSTART:" + stamp(first, start) + "Z",
+                          "DTEND:" + stamp(first, end) + "Z"]
+            else:
+                lines += ["DTSTART;TZID=America/New_York:" + stamp(first, start),
+                          "DTEND;TZID=America/New_York:" + stamp(first, end)]
+            if kind < 0.7:
+                rule = "RRULE:FREQ=WEEKLY;BYDAY=" + weekdayCodes[first.weekday() % 5]
+                if kind < 0.4:
+                    rule += ";COUNT=%d" % rng.randrange(2, 16)
+                elif kind < 0.55:
+                    rule += ";UNTIL=20171208T045959Z"
+                lines.append(rule)
+                if rng.random() < 0.2:
+                    lines.append("EXDATE;TZID=America/New_York:" +
+                                 stamp(first + timedelta(weeks=1), start))
+        lines += ["SUMMARY:Event %d" % event,
+                  "DESCRIPTION:" + "Notes " * 20,
+                  " continued on a folded line"]
+        if rng.random() < 0.5:
+            lines += ["BEGIN:VALARM", "ACTION:DISPLAY", "DESCRIPTION:Reminder",
+                      "TRIGGER:-P0DT0H10M0S", "END:VALARM"]
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+def writeCorpus(directory, mentorCount, seed=0, googleShare=0.5, exportEvents=None):
+    # Writes mentorCount iCals (a googleShare of them Google-style, the
+    # rest SIO-style) into directory; Google-style ones have exportEvents
+    # events if given. Outputs: total bytes written
+    rng = random.Random(seed)
+    makedirs(directory, exist_ok=True)
+    total = 0
+    for mentor in range(mentorCount):
+        if rng.random() < googleShare:
+            text = googleCalendar(rng, exportEvents or rng.randrange(5, 40))
+        else:
+            text = sioCalendar(rng, rng.randrange(3, 7))
+        with open(directory + sep + "Mentor %05d.ics" % mentor, "w", newline="") as icsfile:
+            total += icsfile.write(text)
+    return total
+
+def writeSites(currentPath, siteCount, seed=0):
+    # Writes a Site Times Input.csv with siteCount random sites
+    rng = random.Random(seed)
+    rows = [["Name:"], ["Weekday:"], ["Start time:"], ["End time:"],
+            ["Commuting minutes:"]]
+    for site in range(siteCount):
+        start = rng.randrange(8 * 60, 17 * 60, 15)
+        end = start + rng.choice([45, 60, 90])
+        rows[0].append("Site %04d" % site)
+        rows[1].append(rng.choice(["Monday", "TUES", "wed", "Thursday", "Fri"]))
+        rows[2].append("%02d%02d" % (start // 60, start % 60))
+        rows[3].append("%02d%02d" % (end // 60, end % 60))
+        rows[4].append(str(rng.choice([0, 10, 15, 20, 30])))
+    with open(currentPath, "w", newline="") as csvfile:
+        for row in rows:
+            csvfile.write(",".join(row) + "\r\n")
+
+def csvScan(currentPath, year="2017"):
+    # Phase 1 of read() before parseEvents(): the csv.reader loop with
+    # both its SIO and NON-SIO branches, without the prints and sleeps.
+    # Kept as the reference the streaming parser is timed against.
+    # Outputs: start times, end times and weekdays found
+    startTimes, endTimes, weekdate = [], [], []
+    iCalType = "SIO"
+    zuluTime = False
+    deliver = alarmDetected = False
+    with open(currentPath, newline='') as csvfile:
+        for rowIndex, row in enumerate(csv.reader(csvfile)):
+            if rowIndex == 1 and row[0][:15] != "PRODID:-CMU SIO":
+                iCalType = "NON-SIO"
+            if iCalType == "SIO":
+                if row[0] == "BEGIN:VEVENT":
+                    weeklyFound = False
+                elif row[0][:6] == "DTSTAR":
+                    startTimes.append(row[0][16:])
+                elif row[0][:6] == "DTEND:":
+                    endTimes.append(row[0][14:])
+                elif row[0][:5] == "RRULE":
+                    weeklyFound = True
+                    weekdate.append([row[0][len(row[0]) - 2:]] + row[1:])
+                elif row[0] == "END:VEVENT" and weeklyFound == False:
+                    pass # Non-recurring event warning
+            elif row[0][:7] == "PRODID:":
+                pass # Exported from
+            elif row[0] == "BEGIN:VEVENT":
+                tempStart, tempEnd, deliver, tempEventName = None, None, False, None
+                alarmDetected = False
+            elif row[0][:7] == "SUMMARY":
+                if alarmDetected == False:
+                    tempEventName = row[0][8:]
+            elif row[0] == "BEGIN:VALARM":
+                alarmDetected = True
+            elif row[0] == "END:VALARM":
+                alarmDetected = False
+            elif row[0][:6] == "DTSTAR" or row[0][:5] == "DTEND":
+                startIndex = row[0].find(year)
+                if startIndex != -1 and len(row[0][startIndex:startIndex + 15]) == 15:
+                    if row[0][:6] == "DTSTAR":
+                        tempStart = row[0][startIndex + 9:startIndex + 15]
+                        if zuluTime == False and row[0][len(row[0]) - 1] == "Z":
+                            zuluTime = True
+                    elif row[0][:5] == "DTEND":
+                        tempEnd = row[0][startIndex + 9:startIndex + 15]
+            elif row[0][:5] == "RRULE":
+                freqIndex = row[0].find("FREQ")
+                if row[0][freqIndex + 5:freqIndex + 11] == "WEEKLY":
+                    if row[0].find("UNTIL") != -1 or row[0].find("COUNT") == -1:
+                        deliver = True
+                        weekdate.append([row[0][len(row[0]) - 2:]] + row[1:])
+            elif row[0] == "END:VEVENT" and deliver:
+                startTimes.append("T" + tempStart)
+                endTimes.append("T" + tempEnd)
+    return startTimes, endTimes, weekdate
+
+def parseEvents(currentPath):
+    # Outputs: every Event of an iCal, read the way parseFile() reads it
+    with open(currentPath, 'rb') as icsfile:
+        return list(scheduler.iCal.parseEvents(icsfile.read().decode("utf-8", "replace")))
+
+def timePhase(results, name, items, function, traceMemory, repeat=1):
+    # Runs function() repeat times and records the wall and CPU seconds of
+    # the fastest run, throughput (items per second) and, if traceMemory,
+    # the peak traced bytes
+    if traceMemory:
+        tracemalloc.start()
+    for run in range(repeat):
+        runWall, runCPU = perf_counter(), process_time()
+        value = function()
+        runWall, runCPU = perf_counter() - runWall, process_time() - runCPU
+        if run == 0 or runWall < wall:
+            wall, cpu = runWall, runCPU
+    result = {"seconds": wall, "cpuSeconds": cpu, "items": items,
+              "perSecond": items / wall if wall > 0 else None}
+    if traceMemory:
+        result["peakBytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results[name] = result
+    return value
+
+def bruteForceTeams(a, site, headcount, maxTeam):
+    # Outputs: (size, teams) of the smallest teams of up to maxTeam mentors
+    # that give every interval of the site headcount mentors, found by
+    # trying every group; (None, []) if there are none
+    frees = [site.mask & ~busy for busy in a.busyMasks[site.day]]
+    bits = [bit for bit in range(a.totalIntervals) if site.mask >> bit & 1]
+    for size in range(1, maxTeam + 1):
+        teams = []
+        for group in combinations(range(len(frees)), size):
+            if all(sum(frees[index] >> bit & 1 for index in group) >= headcount
+                   for bit in bits):
+                teams.append(sorted(a.mentorNames[index] for index in group))
+        if teams:
+            return size, teams
+    return None, []
+
+def checkTeams(cases, seed=0):
+    # Runs coverTeams() and bruteForceTeams() on random small cases
+    # Outputs: number of cases where they disagree (each is printed)
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        a = scheduler.iCal(output="silent")
+        a.mentorNames = ["Mentor %02d" % mentor for mentor in range(rng.randrange(1, 14))]
+        # Busy about an eighth, a quarter or half of the day
+        draws = rng.choice([3, 2, 1])
+        a.busyMasks = [[randomMask(rng, a.totalIntervals, draws) for mentor in a.mentorNames]
+                       for day in range(5)]
+        start = rng.randrange(8 * 60, 18 * 60, 30)
+        end = min(start + rng.choice([30, 60, 90, 120]), 23 * 60)
+        site = a.makeSites([["Site", rng.choice(a.weekdayNames), "%02d%02d" % divmod(start, 60),
+                             "%02d%02d" % divmod(end, 60), "0"]])[0]
+        headcount, maxTeam, limit = rng.randrange(1, 4), rng.randrange(1, 5), rng.randrange(1, 6)
+        team = a.coverTeams(site, headcount, maxTeam, limit)
+        size, teams = bruteForceTeams(a, site, headcount, maxTeam)
+        if (team.size != size or team.count != len(teams) or
+                len(team.teams) != min(limit, len(teams)) or
+                any(found not in teams for found in team.teams) or
+                len(set(map(tuple, team.teams))) != len(team.teams)):
+            failures += 1
+            print("Case %d: coverTeams() %r, brute force size %r with %d teams" % (
+                case, team, size, len(teams)))
+    return failures
+
+def minCostAssignment(sites, matches, commutes, capacities, loads):
+    # Inputs: site names, site -> matched mentors, site -> commuting
+    # minutes, site -> mentors it takes and mentor -> sites they can go to
+    # Outputs: (assignments, total commuting minutes) of a minimum-cost
+    # maximum assignment, by successive shortest paths with Bellman-Ford
+    mentors = sorted(loads)
+    node = {name: 2 + index for index, name in enumerate(sites + mentors)}
+    target, capacity, cost, adjacency = [], [], [], [[] for name in range(2 + len(node))]
+
+    def addEdge(start, end, edgeCapacity, edgeCost):
+        for fromNode, toNode, edgeCapacity, edgeCost in [(start, end, edgeCapacity, edgeCost),
+                                                         (end, start, 0, -edgeCost)]:
+            adjacency[fromNode].append(len(target))
+            target.append(toNode)
+            capacity.append(edgeCapacity)
+            cost.append(edgeCost)
+
+    for site in sites:
+        addEdge(0, node[site], capacities[site], commutes[site])
+        for mentor in matches[site]:
+            addEdge(node[site], node[mentor], 1, 0)
+    for mentor in mentors:
+        addEdge(node[mentor], 1, loads[mentor], 0)
+    flow = totalCost = 0
+    while True:
+        distance = [None] * len(adjacency)
+        via = [None] * len(adjacency) # Edge the shortest path arrives by
+        distance[0] = 0
+        for rounds in range(len(adjacency)):
+            changed = False
+            for start in range(len(adjacency)):
+                if distance[start] == None:
+                    continue
+                for edge in adjacency[start]:
+                    end = target[edge]
+                    if capacity[edge] > 0 and (distance[end] == None or
+                                               distance[start] + cost[edge] < distance[end]):
+                        distance[end], via[end] = distance[start] + cost[edge], edge
+                        changed = True
+            if not changed:
+                break
+        if distance[1] == None:
+            return flow, totalCost
+        path, end = [], 1
+        while end != 0:
+            path.append(via[end])
+            end = target[via[end] ^ 1]
+        pushed = min(capacity[edge] for edge in path)
+        for edge in path:
+            capacity[edge] -= pushed
+            capacity[edge ^ 1] += pushed
+        flow += pushed
+        totalCost += pushed * distance[1]
+
+def checkAssign(cases, seed=0):
+    # Runs assign() (with and without minCost) and minCostAssignment() on
+    # random small cases
+    # Outputs: number of cases where assign() breaks a limit or a match,
+    # assigns fewer mentors or, with minCost, commutes longer (each is printed)
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        a = scheduler.iCal(output="silent")
+        sites = ["Site %d" % site for site in range(rng.randrange(1, 8))]
+        mentors = ["Mentor %02d" % mentor for mentor in range(rng.randrange(1, 12))]
+        share = rng.choice([0.2, 0.4, 0.7])
+        a.matchDictionary = {site: set(mentor for mentor in mentors if rng.random() < share)
+                             for site in sites}
+        a.siteCommutes = {site: rng.choice([0, 10, 15, 20, 30]) for site in sites}
+        capacities = {site: rng.randrange(1, 4) for site in sites}
+        loads = {mentor: rng.randrange(1, 3) for mentor in mentors}
+        # Limits as dictionaries (one missing entry falls back to 1) or as one number
+        siteCapacity, mentorLoad = dict(capacities), dict(loads)
+        if rng.random() < 0.5:
+            capacities[sites[0]] = 1
+            del siteCapacity[sites[0]]
+        if rng.random() < 0.3:
+            siteCapacity = rng.randrange(1, 4)
+            capacities = {site: siteCapacity for site in sites}
+        if rng.random() < 0.3:
+            mentorLoad = 1
+            loads = {mentor: 1 for mentor in mentors}
+        flow, totalCost = minCostAssignment(sites, a.matchDictionary, a.siteCommutes,
+                                            capacities, loads)
+        for minCost in (False, True):
+            assignments = a.assign(siteCapacity, mentorLoad, minCost=minCost,
+                                   writeAssignments=False)
+            assigned = [(site, mentor) for site in assignments
+                        for mentor in assignments[site]]
+            problems = []
+            if any(mentor not in a.matchDictionary[site] for site, mentor in assigned):
+                problems.append("unmatched mentor")
+            if len(set(assigned)) != len(assigned):
+                problems.append("mentor twice at one site")
+            if any(len(assignments[site]) > capacities[site] for site in sites):
+                problems.append("site over capacity")
+            if any([mentor for site, mentor in assigned].count(mentor) > loads[mentor]
+                   for mentor in mentors):
+                problems.append("mentor over load")
+            if len(assigned) != flow:
+                problems.append("%d assignments, not %d" % (len(assigned), flow))
+            cost = sum(a.siteCommutes[site] for site, mentor in assigned)
+            if minCost and cost != totalCost:
+                problems.append("%d commuting minutes, not %d" % (cost, totalCost))
+            if problems:
+                failures += 1
+                print("Case %d (minCost=%s): %s" % (case, minCost, ", ".join(problems)))
+                break
+    return failures
+
+def naiveOccurrenceWeeks(a, event):
+    # Outputs: what a.occurrenceWeeks(event) should give, found by visiting
+    # every occurrence from DTSTART on
+    semester = a.semester
+    weeks = [0] * 7
+    start = scheduler.dateOrdinal(event.startDate)
+    exdates = set(scheduler.dateOrdinal(exdate) for exdate in event.exdates)
+
+    def add(ordinal):
+        if ordinal not in exdates and semester.contains(ordinal):
+            weeks[(ordinal - 1) % 7] |= 1 << semester.week(ordinal)
+
+    rrule = event.rrule
+    if rrule == None:
+        add(start)
+        return weeks
+    if rrule.get("FREQ") != "WEEKLY":
+        return weeks
+    interval = int(rrule.get("INTERVAL", 1))
+    count = int(rrule["COUNT"]) if "COUNT" in rrule else None
+    last = scheduler.dateOrdinal(rrule["UNTIL"]) if "UNTIL" in rrule else semester.last
+    days = sorted(set(a.weekdayCodeIndex[code] for code in scheduler.iCal.eventWeekdays(event)))
+    monday = start - (start - 1) % 7
+    seen = 0 # Occurrences so far, as COUNT counts them
+    while monday <= min(last, semester.last):
+        for day in days:
+            ordinal = monday + day
+            if ordinal < start:
+                continue
+            if ordinal > last or seen == count:
+                return weeks
+            seen += 1
+            add(ordinal)
+        monday += 7 * interval
+    return weeks
+
+def checkOccurrences(cases, seed=0):
+    # Runs occurrenceWeeks() and naiveOccurrenceWeeks() on random events
+    # around the default semester
+    # Outputs: number of events where they disagree (each is printed)
+    rng = random.Random(seed)
+    a = scheduler.iCal(output="silent")
+    codes = a.allWeekdayCodes
+    failures = 0
+    for case in range(cases):
+        first = date(2017, 6, 1) + timedelta(days=rng.randrange(240))
+        rrule = None
+        if rng.random() < 0.9:
+            rrule = {"FREQ": "WEEKLY" if rng.random() < 0.95 else "DAILY"}
+            if rng.random() < 0.8:
+                rrule["BYDAY"] = rng.sample(codes, rng.randrange(1, 8))
+            if rng.random() < 0.5:
+                rrule["INTERVAL"] = str(rng.randrange(1, 4))
+            if rng.random() < 0.4:
+                rrule["COUNT"] = str(rng.randrange(0, 40))
+            if rng.random() < 0.5:
+                until = first + timedelta(days=rng.randrange(-10, 200))
+                rrule["UNTIL"] = until.strftime("%Y%m%d") + "T235959"
+        exdates = [(first + timedelta(days=rng.randrange(150))).strftime("%Y%m%d")
+                   for exdate in range(rng.choice([0, 0, 1, 3, 8]))]
+        event = scheduler.Event("Event %d" % case, first.strftime("%Y%m%d"), "100000",
+                                first.strftime("%Y%m%d"), "110000", None, False, rrule,
+                                exdates)
+        weeks, expected = a.occurrenceWeeks(event), naiveOccurrenceWeeks(a, event)
+        if weeks != expected:
+            failures += 1
+            print("Case %d: %r\n  occurrenceWeeks() %r\n  expected %r" % (
+                case, event, weeks, expected))
+    return failures
+
+def randomMask(rng, bits, draws):
+    # Outputs: random bitmask with about one bit in 2 ** draws set
+    mask = rng.getrandbits(bits)
+    for draw in range(draws - 1):
+        mask &= rng.getrandbits(bits)
+    return mask
+
+def runBenchmark(mentorCount, siteCount, workers=1, seed=0, traceMemory=False,
+                 xlsx=True, directory=None, intervalCalls=100000, exportEvents=None,
+                 teamHeadcount=1):
+    # Outputs: dictionary with the run settings and one entry per phase
+    # The module's paths point into the corpus only while it runs
+    oldPaths = (scheduler.iCalPath, scheduler.rootPath)
+    try:
+        with tempfile.TemporaryDirectory() as temporary:
+            root = (directory or temporary) + sep
+            makedirs(root, exist_ok=True)
+            scheduler.setPaths(root + "iCals", root)
+            phases = {}
+            corpusBytes = timePhase(phases, "generate", mentorCount,
+                                    lambda: writeCorpus(root + "iCals", mentorCount, seed,
+                                                        exportEvents=exportEvents),
+                                    False)
+            writeSites(root + "Site Times Input.csv", siteCount, seed)
+
+            # Tokenizing alone, old csv.reader loop against the streaming parser
+            paths = [root + "iCals" + sep + file for file in sorted(listdir(root + "iCals"))]
+            timePhase(phases, "csvScan", mentorCount,
+                      lambda: [csvScan(currentPath) for currentPath in paths], traceMemory, 5)
+            timePhase(phases, "parseEvents", mentorCount,
+                      lambda: [parseEvents(currentPath) for currentPath in paths], traceMemory, 5)
+
+            a = scheduler.iCal(output="silent")
+            a.cachePath = root + "Schedule Cache.json"
+            a.useCache = False
+            timePhase(phases, "read", mentorCount, lambda: a.read(workers), traceMemory)
+
+            # Same read with every schedule in the cache
+            filler = scheduler.iCal(output="silent")
+            filler.cachePath = a.cachePath
+            filler.read(workers)
+            cached = scheduler.iCal(output="silent")
+            cached.cachePath = a.cachePath
+            timePhase(phases, "readCached", mentorCount, lambda: cached.read(),
+                      traceMemory)
+
+            rng = random.Random(seed)
+            pairs = []
+            for call in range(intervalCalls):
+                start, end = randomMeeting(rng)
+                pairs.append((start, end))
+            timePhase(phases, "findInterval", intervalCalls,
+                      lambda: [a.findInterval(start, end) for start, end in pairs],
+                      traceMemory)
+            timePhase(phases, "intervalsBatch", intervalCalls,
+                      lambda: a.intervalsBatch([pair[0] for pair in pairs],
+                                               [pair[1] for pair in pairs]),
+                      traceMemory)
+
+            timePhase(phases, "writeToCSV", mentorCount * 5, lambda: a.writeToCSV(),
+                      traceMemory)
+            if xlsx:
+                timePhase(phases, "writeToXLSX", mentorCount * 5,
+                          lambda: a.writeToXLSX(root + "Tabulation.xlsx"), traceMemory)
+            timePhase(phases, "matchFromCSV", siteCount,
+                      lambda: a.matchFromCSV(), traceMemory)
+            phases["matchFromCSV"]["cellsPerSecond"] = (
+                phases["matchFromCSV"]["perSecond"] * len(a.mentorNames))
+            timePhase(phases, "findTeams", siteCount,
+                      lambda: a.findTeams(teamHeadcount, writeTeams=False), traceMemory)
+
+            result = {"mentors": mentorCount, "sites": siteCount, "workers": workers,
+                      "seed": seed, "exportEvents": exportEvents,
+                      "teamHeadcount": teamHeadcount, "corpusBytes": corpusBytes,
+                      "python": sys.version.split()[0], "phases": phases}
+            if resource != None:
+                # Peak resident set size of this process so far (kB on Linux)
+                result["maxRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return result
+    finally:
+        scheduler.setPaths(*oldPaths)
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark scheduler.py on synthetic data")
+    parser.add_argument("--mentors", type=int, nargs="+", default=[100])
+    parser.add_argument("--sites", type=int, nargs="+", default=[10])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true",
+                        help="record peak traced memory (slows every phase)")
+    parser.add_argument("--no-xlsx", dest="xlsx", action="store_false")
+    parser.add_argument("--keep", metavar="DIR", help="generate the corpus in DIR")
+    parser.add_argument("--export-events", dest="exportEvents", type=int,
+                        help="events in every Google-style calendar")
+    parser.add_argument("--team-headcount", dest="teamHeadcount", type=int, default=1,
+                        help="mentors needed at once in the findTeams phase")
+    parser.add_argument("--check-teams", dest="checkTeams", type=int, metavar="CASES",
+                        help="only check coverTeams() against brute force")
+    parser.add_argument("--check-assign", dest="checkAssign", type=int, metavar="CASES",
+                        help="only check assign() against a min-cost flow reference")
+    parser.add_argument("--check-occurrences", dest="checkOccurrences", type=int,
+                        metavar="CASES",
+                        help="only check occurrenceWeeks() against a naive expansion")
+    parser.add_argument("--output", metavar="FILE", help="also write the results here")
+    options = parser.parse_args(arguments)
+
+    checks = [("teams", options.checkTeams, checkTeams),
+              ("assign", options.checkAssign, checkAssign),
+              ("occurrences", options.checkOccurrences, checkOccurrences)]
+    if any(cases for name, cases, check in checks):
+        failures = 0
+        for name, cases, check in checks:
+            if cases:
+                found = check(cases, options.seed)
+                print(json.dumps({"check": name, "cases": cases, "failures": found}))
+                failures += found
+        return 1 if failures else 0
+
+    results = []
+    for mentorCount in options.mentors:
+        for siteCount in options.sites:
+            results.append(runBenchmark(mentorCount, siteCount, options.workers,
+                                        options.seed, options.memory, options.xlsx,
+                                        options.keep, exportEvents=options.exportEvents,
+                                        teamHeadcount=options.teamHeadcount))
+    text = json.dumps(results, indent=2)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as outputFile:
+            outputFile.write(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
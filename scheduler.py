@@ -4,124 +4,590 @@
 # How to use:
 # 0. Read documentation.
 # 1. Instantiate a class: a = iCal()
+#    (iCal(output="progress") shows progress bars, iCal(output="silent") nothing)
 # 2. Read and perform analysis on all schedules: a.read()
+#    (a.read(workers=None) parses the iCals on every core)
 # 3. Write available times to CSV | XLSX: a.writeToCSV() | a.writeToXLSX()
+#    (a.writeToCSV(a.readIter()) does steps 2 and 3 together)
 # 4. Match mentors to sites: a.matchFromCSV()
+#    (sites = a.loadSites() can be reused: a.matchFromCSV(sites=sites))
+#    (afterwards a.updateMentor(path), a.removeMentor(name), a.updateSite(...)
+#    and a.removeSite(name) patch the matches without a full rebuild)
+#    (without step 2, the schedules are loaded once from Monday.csv ... Friday.csv)
+#    (set a.weekResolved = True before step 2 to also get Week Coverage.csv)
 # 5. Find what sites a mentor can go to: a.findSites("firstName lastName")
+#    (a.findSitesForAll(writeSites=True) does every mentor at once)
+# 6. Assign mentors to sites: a.assign(siteCapacity=3, minCost=True)
+#    (a.findTeams(headcount=2) finds the smallest groups of mentors who
+#    together cover each site, e.g. when nobody is free for all of it)
+# From a shell: python scheduler.py --help (see the end of this file)
+# Or keep everything up to date as iCals are added, changed or removed:
+#    a.watch() (Ctrl+C stops it)
+# a.saveSnapshot() after steps 2 and 4 lets a later session start with
+# a.loadSnapshot() instead of steps 2 and 4.
+# To see where the time goes, call a.instrument() (or a.instrument(profile=True))
+# first and a.report() or a.report("report.json") afterwards.
 
-from math import floor, ceil
 import csv
-from os.path import dirname, abspath, split
-from os import sep, listdir
-from time import sleep
-import xlsxwriter # Comment out this line if xlsxwriter is not installed
+import json
+import mmap
+import re
+import struct
+from hashlib import sha1
+from os.path import dirname, abspath, split, join
+from os import sep, listdir, cpu_count, scandir, stat, replace
+from time import monotonic, perf_counter, process_time, sleep
+import logging
+from collections import namedtuple
+from itertools import combinations, islice
+from math import comb
+from datetime import date
+import sys
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+# xlsxwriter (for writeToXLSX()) and concurrent.futures (for parallel
+# read()) are only imported when first needed, so that quick lookups start
+# fast
 
 iCalPath = dirname(abspath(__file__)) + sep + "iCals" + sep
 rootPath = dirname(abspath(__file__)) + sep 
 
+def setPaths(iCalDirectory=None, rootDirectory=None):
+    # Changes where the iCals are read from and where every other file
+    # (site file, exports, cache, snapshot) lives. Call it before creating
+    # an iCal instance, which takes its cache and snapshot paths from here.
+    global iCalPath, rootPath
+    if iCalDirectory != None:
+        iCalPath = join(abspath(iCalDirectory), "")
+    if rootDirectory != None:
+        rootPath = join(abspath(rootDirectory), "")
+
+# All messages go through this logger. Each record carries an "event" field
+# (and usually "mentor" or "site") so that handlers can filter or format them.
+logger = logging.getLogger("scheduler")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+class OutputLogger(logging.LoggerAdapter):
+    # The module logger as one iCal instance uses it: records below the
+    # instance's output level (see iCal.setOutput()) are dropped, so each
+    # instance keeps its own mode and the logger's own level is left alone
+    def __init__(self, level):
+        logging.LoggerAdapter.__init__(self, logger, {})
+        self.outputLevel = level
+
+    def isEnabledFor(self, level):
+        return level >= self.outputLevel and self.logger.isEnabledFor(level)
+
+    def process(self, msg, kwargs):
+        return msg, kwargs # Keep the "event" fields of every call
+
+# One VEVENT of an iCal file. Dates are "YYYYMMDD" strings and times are
+# "HHMMSS" strings (None for all-day events); rrule maps RRULE parts to
+# their values, with BYDAY split into a list of weekday codes. Events with
+# the same RRULE share its dictionary, so it is not to be changed.
+Event = namedtuple("Event", ["summary", "startDate", "startTime", "endDate",
+                             "endTime", "tzid", "zulu", "rrule", "exdates"])
+
+# One column of the site file. label is "name weekday" as used in Matches.csv,
+# start and end are seconds after midnight, commute is in minutes, day is the
+# weekday index (Monday = 0) and interval/mask the grid intervals (commute
+# included) that a mentor must have free.
+Site = namedtuple("Site", ["label", "name", "weekday", "start", "end", "commute",
+                           "day", "interval", "mask"])
+
+# Result of iCal.coverTeams() for one site: the smallest team size that
+# gives every interval of the site headcount mentors (None if no team of
+# the allowed size does), how many such teams exist and up to limit of them
+Team = namedtuple("Team", ["site", "headcount", "size", "count", "teams"])
+
+def dateOrdinal(text):
+    # "20170828" or "20170828T103000Z" -> proleptic Gregorian day number
+    return dayOrdinal(text[:8])
+
+@lru_cache(maxsize=4096) # Calendars repeat the same few dates
+def dayOrdinal(day):
+    return date(int(day[:4]), int(day[4:6]), int(day[6:8])).toordinal()
+
+class Semester(object):
+    # Named teaching windows of a term, e.g. {"Mini-1": ("20170828",
+    # "20171013")}, with both end dates included. The windows are kept as
+    # ordinal-date ranges plus a lookup table of the whole term, so testing
+    # whether a date falls in any window is O(1).
+    def __init__(self, windows):
+        self.windows = {}
+        for name, (first, last) in windows.items():
+            self.windows[name] = (dateOrdinal(first), dateOrdinal(last))
+        self.first = min(first for first, last in self.windows.values())
+        self.last = max(last for first, last in self.windows.values())
+        self.inWindow = bytearray(self.last - self.first + 1)
+        for first, last in self.windows.values():
+            self.inWindow[first - self.first:last - self.first + 1] = \
+                b"\x01" * (last - first + 1)
+        # Weeks are counted from the Monday of the first window's week
+        self.firstMonday = self.first - date.fromordinal(self.first).weekday()
+        self.weekCount = self.week(self.last) + 1
+        self.teachingWeeks = 0 # Bit w set if week w has a weekday in a window
+        # Bit w of weekdayWeeks[d] set if weekday d of week w is in a window
+        self.weekdayWeeks = [0] * 7
+        for ordinal in range(self.first, self.last + 1):
+            if self.contains(ordinal):
+                self.weekdayWeeks[(ordinal - 1) % 7] |= 1 << self.week(ordinal)
+        for weeks in self.weekdayWeeks[:5]:
+            self.teachingWeeks |= weeks
+
+    def contains(self, ordinal):
+        return (self.first <= ordinal <= self.last and
+                self.inWindow[ordinal - self.first] == 1)
+
+    def week(self, ordinal):
+        # Outputs: index of the term week the date falls in (first week = 0)
+        return (ordinal - self.firstMonday) // 7
+
+    def key(self):
+        return sorted(self.windows.items())
+
+class TimeGrid(object):
+    # The part of the day that schedules are tabulated on: slots of
+    # slotLength seconds from start to end (both in seconds after midnight).
+    # The default is the twenty-two (22) half-hour intervals between
+    # 8:00 AM (08:00) and 7:00 PM (19:00).
+    def __init__(self, start=8 * 3600, end=19 * 3600, slotLength=1800):
+        if slotLength <= 0 or end <= start or (end - start) % slotLength != 0:
+            raise ValueError("The grid must be a whole number of slots long")
+        self.start = start
+        self.end = end
+        self.slotLength = slotLength
+        self.count = (end - start) // slotLength
+
+    def key(self):
+        return [self.start, self.end, self.slotLength]
+
+    def timeLabel(seconds):
+        # e.g. 30600 -> "8:30", 43200 -> "Noon", 48600 -> "1:30"
+        hours, minutes = seconds // 3600, seconds // 60 % 60
+        if hours == 12 and minutes == 0:
+            return "Noon"
+        return "%d:%02d" % ((hours - 1) % 12 + 1, minutes)
+
+    def labels(self):
+        # Outputs: header of the exports, e.g. "8:00-8:30", ..., "6:30-7:00"
+        return ["%s-%s" % (TimeGrid.timeLabel(slot),
+                           TimeGrid.timeLabel(slot + self.slotLength))
+                for slot in range(self.start, self.end, self.slotLength)]
+
+class BusySpans(object):
+    # Busy time of one mentor on one weekday as sorted, non-overlapping
+    # [start, end) spans in seconds after midnight. Overlapping events are
+    # merged into one span (and reported by add()); memory grows with the
+    # number of events, not with the resolution of the grid.
+    def __init__(self, spans=()):
+        # Spans from spans() are already sorted and apart and are taken as
+        # they are; any others are added one by one
+        self.starts = [span[0] for span in spans]
+        self.ends = [span[1] for span in spans]
+        for index in range(1, len(self.starts)):
+            if self.starts[index] < self.ends[index - 1]:
+                self.starts, self.ends = [], []
+                for start, end in spans:
+                    self.add(start, end)
+                break
+
+    def add(self, start, end):
+        # Outputs: True if [start, end) overlaps time that was already busy
+        first = bisect_right(self.ends, start) # First span ending after start
+        last = bisect_left(self.starts, end) # First span starting at/after end
+        if first >= last:
+            self.starts.insert(first, start)
+            self.ends.insert(first, end)
+            return False
+        self.starts[first:last] = [min(start, self.starts[first])]
+        self.ends[first:last] = [max(end, self.ends[last - 1])]
+        return True
+
+    def isFree(self, start, end):
+        # Outputs: True if no busy span overlaps [start, end), in O(log n)
+        first = bisect_right(self.ends, start)
+        return first == len(self.starts) or self.starts[first] >= end
+
+    def spans(self):
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+class LazyList(list):
+    # List whose placeholder entries are built by factory(key) when first
+    # read. A placeholder is the integer key itself, so entries can still
+    # be inserted or deleted before they are built.
+    def __init__(self, keys, factory):
+        list.__init__(self, keys)
+        self.factory = factory
+
+    def __getitem__(self, index):
+        item = list.__getitem__(self, index)
+        if isinstance(index, int) and isinstance(item, int):
+            item = self.factory(item)
+            list.__setitem__(self, index, item)
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+class LazyDict(dict):
+    # Dictionary counterpart of LazyList: a value that is still an integer
+    # key is replaced by factory(key) when first read
+    def __init__(self, keys, factory):
+        dict.__init__(self, keys)
+        self.factory = factory
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, int):
+            value = self.factory(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            dict.__setitem__(self, key, default)
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+class FlowNetwork(object):
+    # Directed graph with integer edge capacities for maximum flow (Dinic's
+    # algorithm). Edge i's reverse edge is i ^ 1, so capacity[i] is always
+    # the capacity left on edge i.
+    def __init__(self, nodeCount):
+        self.adjacency = [[] for node in range(nodeCount)]
+        self.target = []
+        self.capacity = []
+
+    def addEdge(self, start, end, capacity):
+        # Outputs: index of the new edge
+        edge = len(self.target)
+        self.adjacency[start].append(edge)
+        self.target.append(end)
+        self.capacity.append(capacity)
+        self.adjacency[end].append(edge + 1)
+        self.target.append(start)
+        self.capacity.append(0)
+        return edge
+
+    def maxFlow(self, source, sink):
+        # Outputs: flow added on top of whatever already flows in the network
+        adjacency, target, capacity = self.adjacency, self.target, self.capacity
+        total = 0
+        while True:
+            # Breadth-first search builds the level graph, stopping at the
+            # sink's level since longer paths are not used in this phase
+            level = [-1] * len(adjacency)
+            level[source] = 0
+            queue = [source]
+            for node in queue:
+                if level[node] == level[sink]:
+                    break
+                nextLevel = level[node] + 1
+                for edge in adjacency[node]:
+                    if capacity[edge] > 0 and level[target[edge]] < 0:
+                        level[target[edge]] = nextLevel
+                        queue.append(target[edge])
+            if level[sink] < 0:
+                return total
+            # Depth-first search pushes blocking flow along level edges
+            nextEdge = [0] * len(adjacency)
+            path = []
+            node = source
+            while True:
+                if node == sink:
+                    pushed = min([capacity[edge] for edge in path])
+                    for edge in path:
+                        capacity[edge] -= pushed
+                        capacity[edge ^ 1] += pushed
+                    total += pushed
+                    path, node = [], source
+                    continue
+                edges = adjacency[node]
+                index, count = nextEdge[node], len(edges)
+                nextLevel = level[node] + 1
+                while index < count:
+                    edge = edges[index]
+                    if capacity[edge] > 0 and level[target[edge]] == nextLevel:
+                        break
+                    index += 1
+                nextEdge[node] = index
+                if index == count: # Dead end, retreat one edge
+                    if node == source:
+                        break
+                    level[node] = -1
+                    node = target[path.pop() ^ 1]
+                    nextEdge[node] += 1
+                    continue
+                path.append(edge)
+                node = target[edge]
+
+class Progress(object):
+    # Single-line progress bar written to stderr, redrawn at most once
+    # every minInterval seconds no matter how often update() is called
+    def __init__(self, label, total, enabled=True, minInterval=0.2):
+        self.label = label
+        self.total = total
+        self.enabled = enabled
+        self.minInterval = minInterval
+        self.count = 0
+        self.lastDrawn = None
+
+    def update(self, count=1):
+        self.count += count
+        now = monotonic()
+        if self.enabled and (self.lastDrawn == None or
+                             now - self.lastDrawn >= self.minInterval or
+                             self.count >= self.total):
+            self.lastDrawn = now
+            width = 30
+            filled = width * self.count // max(self.total, 1)
+            sys.stderr.write("\r%s [%s%s] %d/%d" % (self.label, "#" * filled,
+                                                    "." * (width - filled),
+                                                    self.count, self.total))
+            sys.stderr.flush()
+
+    def close(self):
+        if self.enabled and self.lastDrawn != None:
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+
+
+class Instrumentation(object):
+    # Collects wall and CPU seconds per phase, parse seconds per file and
+    # counters for iCal.report(). With profile=True, the phases opened with
+    # profile=True also run under cProfile.
+    def __init__(self, profile=False):
+        self.phases = {} # Phase name -> [calls, wall seconds, CPU seconds]
+        self.files = {} # Mentor name -> seconds spent parsing their iCal
+        self.counters = {}
+        self.profiler = None
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def __getstate__(self):
+        # Profilers cannot be pickled (e.g. to a read() worker)
+        state = self.__dict__.copy()
+        state["profiler"] = None
+        return state
+
+    @contextmanager
+    def phase(self, name, profile=False):
+        profile = profile and self.profiler != None
+        if profile:
+            self.profiler.enable()
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self.addTime(name, perf_counter() - wall, process_time() - cpu)
+            if profile:
+                self.profiler.disable()
+
+    def addTime(self, name, wall, cpu, calls=1):
+        totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self, top=20):
+        # Outputs: dictionary of phases, files (slowest first), counters and,
+        # if profiling, the top functions by cumulative time
+        report = {"phases": {name: {"calls": calls, "seconds": wall, "cpuSeconds": cpu}
+                             for name, (calls, wall, cpu) in self.phases.items()},
+                  "files": dict(sorted(self.files.items(),
+                                       key=lambda item: item[1], reverse=True)),
+                  "counters": dict(self.counters)}
+        if self.profiler != None:
+            import pstats
+            stats = pstats.Stats(self.profiler).stats
+            functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+            report["profile"] = [{"function": "%s:%d(%s)" % function, "calls": calls,
+                                  "seconds": ownTime, "cumulativeSeconds": totalTime}
+                                 for function, (primitive, calls, ownTime, totalTime, callers)
+                                 in functions[:top]]
+        return report
+
+
+# The iCal instance a read() worker process parses with, see readIter()
+workerParser = None
+
+def startWorker(parser, path, level):
+    # A spawned worker imports this module afresh, so it also takes over
+    # the level the "scheduler" logger has in the parent process
+    global workerParser, iCalPath
+    workerParser, iCalPath = parser, path
+    logger.setLevel(level)
+
+def parseInWorker(file):
+    return iCal.parseFile(workerParser, file)
+
 class iCal(object):
-    def __init__(self):
-        self.totalIntervals = 22
-        # Twenty-two (22) is the number of half-hour intervals between
-        # 8:00 AM (08:00) and 7:00 PM (19:00)
+    def __init__(self, output="verbose"):
+        self.grid = TimeGrid() # Change with setGrid() before calling read()
+        self.totalIntervals = self.grid.count
         self.extensionReduce = len(".ics") # Remove extension to get the name
 
-        self.year = "2017" # Must be correct for analysis of non-SIO calendars
-        self.startDatesReg = ["20170821", # 1-week back
-                              "20170822",
-                              "20170823",
-                              "20170824",
-                              "20170825",
-                              "20170826",
-                              "20170827",
-                              "20170828", # First day of classes
-                              "20170829",
-                              "20170831",
-                              "20170901",
-                              "20170902",
-                              "20170903",
-                              "20170904",
-                              "20170905",
-                              "20170906"] # 1-week forward
-        self.startDatesMini = ["20171016", # 1-week back
-                              "20171017",
-                              "20171018",
-                              "20171019",
-                              "20171020",
-                              "20171021",
-                              "20171022",
-                              "20171023", # First day of Mini-2/Mini-4 ONLY!!
-                              "20170824",
-                              "20171025",
-                              "20171026",
-                              "20171027",
-                              "20171028",
-                              "20171029",
-                              "20171030",
-                              "20171031"] # 1-week forward
-        self.endDatesReg = ["20171201", # 1-week back
-                             "20171202",
-                             "20171203",
-                             "20171204",
-                             "20171205",
-                             "20171206",
-                             "20171207",
-                             "20171208", # Most likely end date for Mini-1/Mini-3
-                             "20171209",
-                             "20171211",
-                             "20171212",
-                             "20171213",
-                             "20171214",
-                             "20171215",
-                             "20171216",
-                             "20171217"]
-        self.endDatesMini = ["20171009", # 1-week back
-                             "20171010",
-                             "20171011",
-                             "20171012",
-                             "20171013",
-                             "20171014",
-                             "20171015",
-                             "20171016", # Most likely end date
-                             "20171017",
-                             "20171018",
-                             "20171019",
-                             "20171020",
-                             "20171021",
-                             "20171022",
-                             "20171023",
-                             "20171024"] # 1-week forward
-        self.alarmDetected = False # True if BEGIN:VALARM is found
-                                   # While TRUE, ignore SUMMARY until END:VALARM
-        self.deliver = False # For a NON-SIO schedule, if this variable is TRUE,
-                             # then the start and end times are stored
-                             # on the next time END:VEVENT is reached
+        # Teaching windows of the term; an event only blocks a mentor if it
+        # recurs in at least minWeeks different weeks of these windows
+        self.semester = Semester({"Regular": ("20170828", "20171208"),
+                                  "Mini-1": ("20170828", "20171013"),
+                                  "Mini-2": ("20171023", "20171208")})
+        self.minWeeks = 4
 
         self.header = None
-        self.masterSchedule = []
-
-        # Common ways people write weekdays
-        self.mondaySet = set(["Monday", "MONDAY", "MON", "mon", "MO", "mo",
-                              "monday", "Mo", "Mon", "Mondays", "mondays",
-                              "MONDAYS"])
-        self.tuesdaySet = set(["Tuesday", "TUESDAY", "TUE", "tue", "TU", "tu",
-                               "tuesday", "tues", "TUES", "Tues", "Tue",
-                               "Tuesdays", "tuesdays", "TUESDAYS"])
-        self.wednesdaySet = set(["Wednesday", "WEDNESDAY", "WED", "wed", "we",
-                                 "WE", "wednesday", "We", "Wednesdays",
-                                 "WEDNESDAYS", "wednesdays"])
-        self.thursdaySet = set(["Thursday", "THURSDAY", "thursday", "THU", "thu",
-                                "TH", "th", "Thurs", "THURS", "thurs", "Thu",
-                                "Th", "thursdays", "THURSDAYS", "Thursdays"])
-        self.fridaySet = set(["Friday", "FRIDAY", "FRI", "Fri", "Fr", "FR", "fri",
-                              "friday", "fr", "fridays", "Fridays", "FRIDAYS",
-                              "friyay"])
-        self.analysisSet = set(["Analysis", "ANALYSIS", "analysis"])
 
+        # Bitmask availability: bit i of a mask is set when interval i is busy.
+        # busyMasks holds one list per weekday (Monday = 0) with one integer
+        # per mentor, in the same order as mentorNames. Export rows are built
+        # from the masks when written (see scheduleRow()), never stored.
+        self.weekdayCodes = ["MO", "TU", "WE", "TH", "FR"]
+        self.allWeekdayCodes = self.weekdayCodes + ["SA", "SU"]
+        self.weekdayCodeIndex = {code: day for day, code in enumerate(self.allWeekdayCodes)}
+        self.weekdayNames = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+        self.fullMask = (1 << self.totalIntervals) - 1
+        self.mentorNames = []
+        self.mentorIndex = {} # Mentor name -> position in mentorNames
+        self.busyMasks = [[], [], [], [], []]
+        self.busySpans = [[], [], [], [], []] # Same layout, BusySpans objects
+        self.conflicts = {} # Mentor name -> overlapping events found
+        # Set once read(), readFromCSV(), loadSnapshot() or updateMentor()
+        # has put schedules in memory, even if they hold no mentors
+        self.schedulesLoaded = False
+
+        # Week-resolved mode keeps one bit-packed weeks x intervals matrix
+        # per mentor per weekday (see weekMask()) and makes matchFromCSV()
+        # report how many weeks each mentor can cover each site
+        self.weekResolved = False
+        self.weekMasks = [[], [], [], [], []]
+        self.weekCoverages = {} # Detailed site name -> {mentor: weeks}
+
+        # Common ways people write weekdays, lowercased: any prefix of the
+        # name of at least two letters ("we", "thurs", ...) or its plural
+        self.weekdayAliases = {"friyay": 4}
+        for day, dayName in enumerate(self.weekdayNames):
+            dayName = dayName.lower()
+            self.weekdayAliases[dayName + "s"] = day
+            for length in range(2, len(dayName) + 1):
+                self.weekdayAliases[dayName[:length]] = day
+        self.analysisSet = set(["analysis"]) # Lowercased, like weekdayAliases
+
+        self.sites = [] # Site records of the last matchFromCSV()
         self.matchDictionary = {}
+        self.mentorSites = {} # Reverse of matchDictionary: mentor -> sites
+        self.siteCommutes = {} # Detailed site name -> commuting minutes
+        self.assignments = {}
+        self.teams = {} # Detailed site name -> Team, see findTeams()
+        iCal.setOutput(self, output)
+        self.instrumentation = None # See instrument()
         self.validMentorName = set() # Used to see if a valid mentor name was 
                                      # entered in findSites() function
 
+        # Parsed schedules are cached by iCal content hash between runs
+        self.useCache = True
+        self.cachePath = rootPath + "Schedule Cache.json"
+        self.cacheVersion = 6 # Bump whenever parseFile() output changes
+
+        # Binary snapshot of the whole state, see saveSnapshot()
+        self.snapshotPath = rootPath + "Schedule Snapshot.bin"
+        self.snapshotMap = None # Memory map of the loaded snapshot, if any
+        self.snapshotViews = [] # Memoryviews into snapshotMap
+
+    def setGrid(self, grid):
+        # Inputs: TimeGrid, e.g. TimeGrid(8 * 3600, 21 * 3600, 900) for
+        # 15-minute intervals from 8:00 AM to 9:00 PM
+        # Schedules and sites already in memory are moved onto the new grid
+        # from their exact times (matches stay as they are until the next
+        # matchFromCSV()). Week-resolved schedules keep no exact times, so
+        # with those in memory this raises ValueError: call it before read().
+        if any(self.weekMasks):
+            raise ValueError("Week-resolved schedules cannot be moved to another "
+                             "grid, call setGrid() before read()")
+        oldGrid = self.grid
+        self.grid, self.totalIntervals = grid, grid.count
+        intervals = iCal.intervalsBatch(
+            self, [site.start - site.commute * 60 for site in self.sites],
+            [site.end + site.commute * 60 for site in self.sites])
+        if None in intervals:
+            self.grid, self.totalIntervals = oldGrid, oldGrid.count
+            raise ValueError("Site %r lies outside the new grid" %
+                             self.sites[intervals.index(None)].label)
+        self.fullMask = (1 << self.totalIntervals) - 1
+        self.sites = [site._replace(interval=interval, mask=iCal.intervalMask(interval))
+                      for site, interval in zip(self.sites, intervals)]
+        for day in range(5):
+            self.busyMasks[day] = [iCal.spansMask(self, spans) for spans in self.busySpans[day]]
+
+    def setOutput(self, output):
+        # "verbose" logs every message, "progress" logs only warnings and
+        # shows progress bars instead, "silent" shows nothing at all
+        levels = {"verbose": logging.INFO, "progress": logging.WARNING,
+                  "silent": logging.CRITICAL + 1}
+        if output not in levels:
+            raise ValueError("Unknown output mode: %s" % output)
+        self.output = output
+        self.showProgress = output == "progress"
+        self.logger = OutputLogger(levels[output])
+
+    def instrument(self, profile=False):
+        # Starts collecting phase timings, per-file parse times and counters
+        # (see report()); profile=True also runs read() and matchFromCSV()
+        # under cProfile. Any earlier measurements are discarded.
+        self.instrumentation = Instrumentation(profile)
+        return self.instrumentation
+
+    def phase(self, name, profile=False):
+        # Context manager timing one phase, if instrumented
+        if self.instrumentation == None:
+            return nullcontext()
+        return self.instrumentation.phase(name, profile)
+
+    def report(self, currentPath=None):
+        # Outputs: dictionary of everything measured since instrument() (empty
+        # if not instrumented), also written as JSON to currentPath if given
+        report = self.instrumentation.report() if self.instrumentation != None else {}
+        if currentPath != None:
+            with open(currentPath, 'w') as reportFile:
+                json.dump(report, reportFile, indent=2)
+        return report
+
+    def __getstate__(self):
+        # A loaded snapshot's memory map and lazy entries cannot be pickled
+        # (e.g. to a read() worker): the copy gets them decoded instead
+        state = self.__dict__.copy()
+        if self.snapshotMap != None:
+            state["busySpans"] = [list(spans) for spans in self.busySpans]
+            state["mentorSites"] = dict(self.mentorSites.items())
+            state["matchDictionary"] = dict(self.matchDictionary.items())
+            state["snapshotMap"], state["snapshotViews"] = None, []
+        return state
+
     def __hash__(self):
         return self # only integers are hashed in this program
 
@@ -135,23 +601,33 @@ class iCal(object):
         return count
 
     def secondstime(binarytime): #converts to seconds
-        if (iCal.digitcount(binarytime) < 3): #under 60 seconds
-            return binarytime
-        elif (iCal.digitcount(binarytime) < 5): #under 60 minutes
-            secondsdigits = binarytime % 100 #seconds count
-            minutesdigits = binarytime // 100 #minutes count
-            return minutesdigits * 60 + secondsdigits
-        else: #over 60 minutes
-            secondsdigits = binarytime % 100
-            hourdigit = binarytime // 10000 #hours count
-            minutesdigits = (binarytime - hourdigit * 10000) // 100
-            return hourdigit * 3600 + minutesdigits * 60 + secondsdigits
+        # Same result as counting digits: missing hours/minutes are zero
+        return binarytime // 10000 * 3600 + binarytime // 100 % 100 * 60 + binarytime % 100
+
+    def secondsBatch(stamps):
+        # Inputs: list of HHMMSS stamps (strings or integers, leading zeros
+        # optional, e.g. "083000", "83000" or 83000)
+        # Outputs: list of seconds after midnight for every stamp
+        # No NumPy path: converting strings to a NumPy array costs more than
+        # this whole loop at every batch size
+        return [stamp // 10000 * 3600 + stamp // 100 % 100 * 60 + stamp % 100
+                for stamp in map(int, stamps)]
+
+    def intervalsBatch(self, starts, ends):
+        # Inputs: lists of start and end times in seconds
+        # Outputs: list of (startInterval, endInterval) spans, or None where
+        # the pair misses the grid, as findInterval() gives for each pair
+        # The batches are a few spans per mentor and weekday, too small for
+        # NumPy to pay for converting them
+        return [iCal.findInterval(self, start, end) for start, end in zip(starts, ends)]
 
     def findInterval(self, start, end):
         # Inputs: start and end times in seconds
-        # Outputs: interval corresponding to the start and end times
-        startInterval = floor(start / 1800) - 16 #1800 is the number of seconds in 30'
-        endInterval = ceil(end / 1800) - 17 # subtract 1 more than above
+        # Outputs: (startInterval, endInterval) span of the grid intervals
+        # the start and end times touch, or None if they miss the grid
+        startInterval = (start - self.grid.start) // self.grid.slotLength
+        # Rounded up, then one less since the end is exclusive
+        endInterval = -((self.grid.start - end) // self.grid.slotLength) - 1
         
         # Case with an event that has a duration of 0 minutes
         if endInterval < startInterval:
@@ -175,553 +651,1648 @@ class iCal(object):
         elif endInterval > (self.totalIntervals - 1):
             endInterval = self.totalIntervals - 1
 
-        return list(range(startInterval, endInterval + 1))
-
-    def read(self):
-        for file in listdir(iCalPath):
-
-            # Phase 1: Open the iCal file and retrieve desired data
-            currentPath = iCalPath + file
-            startTimes, endTimes, weekdate = [], [], []
-            currentName = split(currentPath)[1][:-self.extensionReduce]
-            sleep(0.1)
-            print(currentName)
-            iCalType = "SIO"
-            zuluTime = False # If TRUE, raise alert!
-
-            with open(currentPath, newline='') as csvfile:
-                iCalRowReader = csv.reader(csvfile)
-                weeklyFound = False # for SIO schedules to check anomalies 
-                tempStart, tempEnd = None, None # Used for non SIO-generated calendars 
-                tempEventName = None
-                tempCountStartDate = None # Used for non SIO-generated calendars 
-                                          # that use COUNT for recurrence
-                countInRange = False # True if an event starts in the desired range
-                for rowIndex, row in enumerate(iCalRowReader):
-                    # print(row) #uncommenting this line shows the entire iCal
-                    # Check if iCal file is SIO-generated
-                    if rowIndex == 1: 
-                        if row[0][:15] != "PRODID:-CMU SIO": # not SIO-generated
-                            print("-----------------------------------------")
-                            print("%s's schedule NON SIO-GENERATED!" % currentName) 
-                            print("-----------------------------------------")
-                            iCalType = "NON-SIO"
-                    if iCalType == "SIO":
-                        if row[0] == "BEGIN:VEVENT":
-                            weeklyFound = False
-                        elif row[0][:6] == "DTSTAR": # found start time
-                            startTimes.append(row[0][16:])
-                        elif row[0][:6] == "DTEND:": # found end time
-                            endTimes.append(row[0][14:])
-                        elif row[0][:5] == "RRULE":
-                            weeklyFound = True
-                            days = [row[0][len(row[0]) - 2:]] #first date
-                            daysInRow = len(row)
-                            if daysInRow > 1:
-                                additionalDays = row[1:] 
-                                days += (additionalDays)
-                            weekdate.append(days)
-                        elif row[0] == "END:VEVENT":
-                            if weeklyFound == False: # Found non-weekly event?!
-                                print("-----------------------------------------")
-                                print("WARNING: Non-recurring event detected!")
-                                print("-----------------------------------------")
-                    else: # NON-SIO attempt to find relevant events
-                        if row[0][:7] == "PRODID:":
-                            print("Exported from: %s" % row[0][7:])
-                        elif row[0] == "BEGIN:VEVENT":
-                            tempStart, tempEnd, self.deliver = None, None, False
-                            tempEventName = None
-                            countInRange = False
-                            self.alarmDetected = False
-                        elif row[0][:7] == "SUMMARY":
-                            if self.alarmDetected == False:
-                                tempEventName = row[0][8:]
-                        elif row[0] == "BEGIN:VALARM":
-                            self.alarmDetected = True
-                        elif row[0] == "END:VALARM":
-                            self.alarmDetected = False
-                        elif row[0][:6] == "DTSTAR" or row[0][:5] == "DTEND": 
-                            # print(row[0])
-                            startIndex = row[0].find(self.year)
-                            tempCountStartDate = row[0][startIndex:startIndex + 8]
-                            # print(tempCountStartDate)
-                            if (tempCountStartDate in self.startDatesReg or
-                                tempCountStartDate in self.startDatesMini):
-                                countInRange = True
-                            if startIndex != -1: 
-                                # print(row[0][startIndex:startIndex + 15], "Length: ", len(row[0][startIndex:startIndex + 15]))
-                                # Check to see if the event lasts the whole day
-                                eventCharacterLength = len(row[0][startIndex:startIndex + 15])
-                                if eventCharacterLength == 15:
-                                    # print(row[0][startIndex + 9:startIndex + 15])
-                                    if row[0][:6] == "DTSTAR":
-                                        tempStart = row[0][startIndex + 9:startIndex + 15]
-                                        if zuluTime == False:
-                                            if (row[0][len(row[0]) - 1]) == "Z":
-                                                zuluTime = True
-                                                print("WARNING: Zulu time detected!")
-                                                print("Add 5 hours when importing into calendar")
-                                        # print("start:", tempStart)
-                                    elif row[0][:5] == "DTEND":
-                                        tempEnd = row[0][startIndex + 9:startIndex + 15]
-                                        # print("end:", tempEnd)
-                        elif row[0][:5] == "RRULE":
-                            freqIndex = row[0].find("FREQ")
-                            frequency = row[0][freqIndex + 5:freqIndex + 11]
-                            # print(frequency)
-                            if frequency == "WEEKLY":
-                                untilIndex = row[0].find("UNTIL")
-                                if untilIndex != -1: # Make sure that UNTIL is even there
-                                    # print("Until:", row[0][untilIndex + 6:untilIndex + 14])
-                                    until = row[0][untilIndex + 6:untilIndex + 14]
-                                    if (until in self.endDatesReg or
-                                        until in self.endDatesMini):
-                                        self.deliver = True
-                                        days = [row[0][len(row[0]) - 2:]] #first date
-                                        daysInRow = len(row)
-                                        if daysInRow > 1:
-                                            additionalDays = row[1:] 
-                                            days += (additionalDays)
-                                        weekdate.append(days)
-                                else:
-                                    countIndex = row[0].find("COUNT")
-                                    if countIndex == -1: 
-                                        print("Found weekly event with infinite recurrence.")
-                                        self.deliver = True
-                                        days = [row[0][len(row[0]) - 2:]] #first date
-                                        daysInRow = len(row)
-                                        if daysInRow > 1:
-                                            additionalDays = row[1:] 
-                                            days += (additionalDays)
-                                        weekdate.append(days)
-                                    else:
-                                        intervalIndex = row[0].find("INTERVAL")
-                                        if intervalIndex == -1: # not biweekly since courses are never biweekly
-                                            bydayIndex = row[0].find("BYDAY")
-                                            # print("Count:", row[0][countIndex + 6:bydayIndex - 1])
-                                            count = int(row[0][countIndex + 6:bydayIndex - 1])
-                                            if count > 7: # significant recurrence
-                                                if countInRange:
-                                                    self.deliver = True
-                                                    days = [row[0][len(row[0]) - 2:]] #first date
-                                                    daysInRow = len(row)
-                                                    if daysInRow > 1:
-                                                        additionalDays = row[1:] 
-                                                        days += (additionalDays)
-                                                    weekdate.append(days)
-                        elif row[0] == "END:VEVENT":
-                            if self.deliver:
-                                tempStart = "T" + tempStart
-                                tempEnd = "T" + tempEnd
-                                startTimes.append(tempStart)
-                                endTimes.append(tempEnd)
-                                sleep(0.1)
-                                print("Found possible event:", tempEventName)
-
-            # print("startTimes:", startTimes)
-            # print("endTimes:", endTimes)
-            # print("weekdates", weekdate)
-            
-            # Phase 2: Remove 'T' and leading zeros
-            startTimesFormatted, endTimesFormatted = [], []
-            for startTime in startTimes: #loop invariants omitted
-                if startTime[0] != "T": print("READ ERROR! Delimiter not 'T'")
-                elif startTime[1] == "0": 
-                    startTimesFormatted.append(int(startTime[2:]))
-                elif startTime[1] != "0":
-                    startTimesFormatted.append(int(startTime[1:]))
-            for endTime in endTimes:
-                if endTime[0] != "T": print("READ ERROR! Delimiter not 'T'")
-                elif endTime[1] == "0": 
-                    endTimesFormatted.append(int(endTime[2:]))
-                elif endTime[1] != "0":
-                    endTimesFormatted.append(int(endTime[1:]))
-            # print("startTimesFormatted:", startTimesFormatted)   
-            # print("endTimesFormatted:", endTimesFormatted)
-
-            # Phase 3: Convert formatted times into seconds after midnight
-            startTimeSeconds, endTimesSeconds = [], []
-            for startTime in startTimesFormatted:
-                startTimeSeconds.append(iCal.secondstime(startTime))
-            for endTime in endTimesFormatted:
-                endTimesSeconds.append(iCal.secondstime(endTime))
-            # print("startSeconds:", startTimeSeconds)   
-            # print("endSeconds:", endTimesSeconds)
-
-            # Phase 4: Build the busy intervals
-            # Note that the use of the set data structure, of course, assumes 
-            # that there are no conflicting intervals; conflicting intervals
-            # are discarded.
-            mondayIntervalsBusy = set()
-            tuesdayIntervalsBusy = set()
-            wednesdayIntervalsBusy = set()
-            thursdayIntervalsBusy = set()
-            fridayIntervalsBusy = set()
-            for eventIndex in range(len(weekdate)):
-                interval = iCal.findInterval(self,
-                                             startTimeSeconds[eventIndex],
-                                             endTimesSeconds[eventIndex])
-                # print(interval)
-                if interval != None:
-                    if "MO" in weekdate[eventIndex]:
-                        for i in interval:
-                            mondayIntervalsBusy.add(i)
-                    if "TU" in weekdate[eventIndex]: 
-                        for i in interval:
-                            tuesdayIntervalsBusy.add(i)
-                    if "WE" in weekdate[eventIndex]:
-                        for i in interval:
-                            wednesdayIntervalsBusy.add(i)
-                    if "TH" in weekdate[eventIndex]:
-                        for i in interval:
-                            thursdayIntervalsBusy.add(i)
-                    if "FR" in weekdate[eventIndex]:
-                        for i in interval:
-                            fridayIntervalsBusy.add(i)
-            # print("Monday:", mondayIntervalsBusy)
-            # print("Tuesday:", tuesdayIntervalsBusy)
-            # print("Wednesday:", wednesdayIntervalsBusy)
-            # print("Thursday:", thursdayIntervalsBusy)
-            # print("Friday:", fridayIntervalsBusy)
-            
-            # Phase 4A: Build the free intervals (DEBUGGING PURPOSES)
-            # original = set(list(range(self.totalIntervals)))
-            # mondayIntervalsFree = original - mondayIntervalsBusy
-            # tuesdayIntervalsFree = original - tuesdayIntervalsBusy
-            # wednesdayIntervalsFree = original - wednesdayIntervalsBusy
-            # thursdayIntervalsFree = original - thursdayIntervalsBusy
-            # fridayIntervalsFree = original - fridayIntervalsBusy
-            # print("And the free intervals:")
-            # print("Monday:", mondayIntervalsFree)
-            # print("Tuesday:", tuesdayIntervalsFree)
-            # print("Wednesday:", wednesdayIntervalsFree)
-            # print("Thursday:", thursdayIntervalsFree)
-            # print("Friday:", fridayIntervalsFree)
-
-            # Phase 5: Build the list which gets outputted 
-            monday = [currentName] * self.totalIntervals
-            tuesday = [currentName] * self.totalIntervals
-            wednesday = [currentName] * self.totalIntervals
-            thursday = [currentName] * self.totalIntervals
-            friday = [currentName] * self.totalIntervals
-            
-            # Empty space means busy interval
-            for i in mondayIntervalsBusy:
-                monday[i] = ""
-            for i in tuesdayIntervalsBusy:
-                tuesday[i] = ""
-            for i in wednesdayIntervalsBusy:
-                wednesday[i] = ""
-            for i in thursdayIntervalsBusy:
-                thursday[i] = ""
-            for i in fridayIntervalsBusy:
-                friday[i] = ""
-            # print("Monday:", monday)
-            # print("Tuesday:", tuesday)
-            # print("Wednesday:", wednesday)
-            # print("Thursday:", thursday)
-            # print("Friday:", friday)
-
-            # Phase 7: Append student's intervals to master list
-            self.masterSchedule.append([monday, tuesday,
-                                        wednesday, thursday,
-                                        friday])
-
-    def writeToCSV(self): # Run this function if xlsxwriter is not installed
-        print("Writing all schedules to CSV")
-        currentPath = rootPath + "Template.csv"
-        with open(currentPath, newline='') as csvfile:
-            templateReader = csv.reader(csvfile)
-            for row in templateReader:
-                self.header = row
-        # print(self.header)
+        return (startInterval, endInterval)
+
+    def intervalMask(interval):
+        # Inputs: (startInterval, endInterval) span from findInterval() or
+        # intervalsBatch(), or a list of consecutive interval indices
+        # Outputs: bitmask with the bits of those intervals set
+        if interval == None:
+            return 0
+        return ((1 << (interval[-1] - interval[0] + 1)) - 1) << interval[0]
+
+    def availableMentors(self, day, siteMask):
+        # Inputs: weekday index (Monday = 0) and bitmask of the needed intervals
+        # Outputs: names of all mentors who are free for every needed interval
+        return [name for name, busy in zip(self.mentorNames, self.busyMasks[day])
+                if not busy & siteMask]
+
+    # Content lines parseEvents() looks at: a line break, one of these
+    # property names (in any case) and the rest of the line from the ';' or
+    # ':' that follows the name, folded continuation lines included. Every
+    # other line is skipped by the regular expression engine without any
+    # Python code running for it. The rest keeps the '\r' of a CRLF line
+    # break ('.' is much faster to match than '[^\r\n]'); propertyValue()
+    # takes it off.
+    lineNames = frozenset(["BEGIN", "END", "SUMMARY", "DTSTART", "DTEND", "RRULE",
+                           "EXDATE", "PRODID"])
+    contentLine = re.compile(r"\n(BEGIN|END|SUMMARY|DT(?:START|END)|RRULE|EXDATE|PRODID)"
+                             r"([;:].*(?:\n[ \t].*)*)", re.IGNORECASE)
+    foldedLine = re.compile(r"\r?\n[ \t]")
+
+    @lru_cache(maxsize=256) # Every DTSTART of a calendar has the same TZID
+    def parseParameters(head):
+        # Inputs: property name and parameters, e.g.
+        # "DTSTART;TZID=America/New_York;VALUE=DATE-TIME"
+        # Outputs: dictionary of parameter name -> value, shared between
+        # calls with the same head, so not to be changed
+        parameters = {}
+        for part in head.split(";")[1:]:
+            key, _, parameter = part.partition("=")
+            parameters[key.upper()] = parameter.strip('"')
+        return parameters
+
+    def parseProperty(line):
+        # Inputs: one unfolded content line, e.g.
+        # "DTSTART;TZID=America/New_York:20170828T103000"
+        # Outputs: (name, parameters dictionary, value)
+        # Parameter values may be quoted and contain ':' or ';'
+        if '"' not in line: # Common case, no quoted parameter values
+            head, _, value = line.partition(":")
+            return head.partition(";")[0].upper(), iCal.parseParameters(head), value
+        quoted = False
+        for index, character in enumerate(line):
+            if character == '"':
+                quoted = not quoted
+            elif character == ":" and not quoted:
+                break
+        else:
+            return line.upper(), {}, ""
+        head, value = line[:index], line[index + 1:]
+        return head.partition(";")[0].upper(), iCal.parseParameters(head), value
+
+    def propertyValue(rest):
+        # Inputs: rest of a content line after the property name, e.g.
+        # ";TZID=America/New_York:20170828T103000", possibly folded
+        # Outputs: (parameters dictionary or None, value)
+        if "\n" in rest:
+            rest = iCal.foldedLine.sub("", rest)
+        if rest[-1] == "\r":
+            rest = rest[:-1]
+        if rest[0] == ":":
+            return None, rest[1:]
+        if '"' in rest: # A quoted parameter value may hold ':'
+            _, parameters, value = iCal.parseProperty("X" + rest)
+            return parameters, value
+        head, _, value = rest.partition(":")
+        return iCal.parseParameters(head), value
+
+    def parseEvents(icsfile, calendar=None, nested=None):
+        # Inputs: open iCal file or its text, optional dictionary which
+        # receives the PRODID of the VCALENDAR itself and optional
+        # dictionary which counts components nested in a VEVENT
+        # Outputs: generator of Event records, one per VEVENT; times are
+        # None for all-day (VALUE=DATE) events
+        # Properties of components nested in a VEVENT (VALARM) are ignored.
+        # Only the lines matched by contentLine reach the loop below, and
+        # their values are only split from their parameters once the event
+        # is complete.
+        text = icsfile if isinstance(icsfile, str) else icsfile.read()
+        if "\n" not in text: # Old Mac line breaks
+            text = text.replace("\r", "\n")
+        lineNames = iCal.lineNames
+        depth = 0 # Number of components currently open
+        eventDepth = None # Depth of the open VEVENT, if any
+        for name, rest in iCal.contentLine.findall("\n" + text):
+            if name not in lineNames:
+                name = name.upper()
+            if name == "BEGIN":
+                depth += 1
+                component = iCal.propertyValue(rest)[1].upper()
+                if eventDepth == None and component == "VEVENT":
+                    eventDepth = depth
+                    found, exdates = {}, [] # Rest of each line, EXDATE dates
+                elif eventDepth != None and nested != None:
+                    nested[component] = nested.get(component, 0) + 1
+            elif name == "END":
+                if depth == eventDepth:
+                    eventDepth = None
+                    yield iCal.buildEvent(found, exdates)
+                depth -= 1
+            elif depth == eventDepth:
+                if name == "EXDATE":
+                    exdates += [exdate[:8] for exdate in
+                                iCal.propertyValue(rest)[1].split(",")]
+                else:
+                    found[name] = rest
+            elif depth == 1 and calendar != None: # VCALENDAR property
+                calendar[name] = iCal.propertyValue(rest)[1]
+
+    @lru_cache(maxsize=256) # Calendars repeat the same few rules
+    def parseRule(rule):
+        # Inputs: RRULE value, e.g. "FREQ=WEEKLY;UNTIL=20171208T235959;BYDAY=MO,WE"
+        # Outputs: dictionary of rule part -> value (uppercased), BYDAY split
+        # into a list, shared between calls with the same rule
+        rrule = {}
+        for part in rule.split(";"):
+            key, _, ruleValue = part.partition("=")
+            rrule[key.upper()] = ruleValue.upper() # e.g. "freq=weekly" too
+        if "BYDAY" in rrule:
+            rrule["BYDAY"] = rrule["BYDAY"].split(",")
+        return rrule
+
+    def buildEvent(found, exdates):
+        # Inputs: dictionary of property name -> rest of its content line
+        # for one VEVENT and its EXDATE dates
+        # Outputs: Event record
+        startTime = endTime = tzid = rrule = summary = None
+        start = end = ""
+        if "DTSTART" in found:
+            parameters, start = iCal.propertyValue(found["DTSTART"])
+            if "T" in start:
+                startTime = start[9:15]
+            if parameters != None:
+                if parameters.get("VALUE") == "DATE":
+                    startTime = None
+                tzid = parameters.get("TZID")
+        if "DTEND" in found:
+            parameters, end = iCal.propertyValue(found["DTEND"])
+            if "T" in end and (parameters == None or parameters.get("VALUE") != "DATE"):
+                endTime = end[9:15]
+        if "RRULE" in found:
+            rrule = iCal.parseRule(iCal.propertyValue(found["RRULE"])[1])
+        if "SUMMARY" in found:
+            summary = iCal.propertyValue(found["SUMMARY"])[1]
+        return Event(summary, start[:8] or None, startTime, end[:8] or None, endTime,
+                     tzid, start[-1:] == "Z" or end[-1:] == "Z", rrule, exdates)
+
+    def eventWeekdays(event):
+        # Outputs: two-letter weekday codes an event recurs on; without
+        # BYDAY a weekly event repeats on the weekday of its DTSTART
+        if event.rrule != None and "BYDAY" in event.rrule:
+            return [day[-2:] for day in event.rrule["BYDAY"]]
+        # Ordinal 1 (1 January of year 1) is a Monday
+        return [["MO", "TU", "WE", "TH", "FR", "SA", "SU"][
+            (dateOrdinal(event.startDate) - 1) % 7]]
+
+    def occurrenceWeeks(self, event):
+        # Inputs: Event record
+        # Outputs: seven bitmasks, one per weekday (Monday = 0), with bit w
+        # set if the event takes place on that weekday of term week w inside
+        # the semester windows. Weekly rules honour INTERVAL, UNTIL, COUNT
+        # (which counts occurrences before EXDATE removes any) and EXDATE;
+        # other frequencies are not expanded. Each weekday's series is worked
+        # out from ordinals, without visiting every occurrence.
+        # Raises ValueError for an INTERVAL or COUNT that is not a positive
+        # (COUNT: non-negative) whole number, or an invalid UNTIL date.
+        semester = self.semester
+        weeks = [0] * 7
+        start = dateOrdinal(event.startDate)
+        exdates = [dateOrdinal(exdate) for exdate in event.exdates]
+        rrule = event.rrule
+        if rrule == None:
+            if start not in exdates and semester.contains(start):
+                weeks[(start - 1) % 7] = 1 << semester.week(start)
+            return weeks
+        if rrule.get("FREQ") != "WEEKLY":
+            return weeks
+        count = None
+        try:
+            interval = int(rrule.get("INTERVAL", 1))
+            count = int(rrule["COUNT"]) if "COUNT" in rrule else None
+        except ValueError:
+            interval = 0
+        if interval < 1 or (count != None and count < 0):
+            raise ValueError("RRULE has INTERVAL %r and COUNT %r" % (
+                rrule.get("INTERVAL", "1"), rrule.get("COUNT")))
+        last = semester.last
+        if "UNTIL" in rrule:
+            try:
+                last = min(last, dateOrdinal(rrule["UNTIL"]))
+            except ValueError:
+                raise ValueError("RRULE has UNTIL %r" % rrule["UNTIL"])
+        weekdayIndex = self.weekdayCodeIndex
+        weekdays = sorted(set(weekdayIndex[code] for code in iCal.eventWeekdays(event)
+                              if code in weekdayIndex))
+        if not weekdays:
+            return weeks
+        monday = start - (start - 1) % 7
+        period = 7 * interval
+        if count != None:
+            # The date of the COUNTth occurrence ends the series
+            firstWeek = [day for day in weekdays if monday + day >= start]
+            if count <= len(firstWeek):
+                if count == 0:
+                    return weeks
+                last = min(last, monday + firstWeek[count - 1])
+            else:
+                periods, index = divmod(count - len(firstWeek) - 1, len(weekdays))
+                last = min(last, monday + period * (periods + 1) + weekdays[index])
+        for day in weekdays:
+            first = monday + day
+            if first < start:
+                first += period
+            if first < semester.first: # Skip whole periods before the term
+                first += (semester.first - first + period - 1) // period * period
+            if first > last:
+                continue
+            # One bit every interval weeks, once per occurrence
+            occurrences = (last - first) // period + 1
+            bits = (((1 << (occurrences * interval)) - 1) // ((1 << interval) - 1)
+                    << semester.week(first))
+            for exdate in exdates:
+                if first <= exdate <= last and (exdate - first) % period == 0:
+                    bits &= ~(1 << semester.week(exdate))
+            weeks[day] = bits & semester.weekdayWeeks[day]
+        return weeks
+
+    def parseFile(self, file, content=None):
+        # Inputs: file name of an iCal in iCalPath (or a full path) and, if
+        # the caller already read it, the file's bytes
+        # Outputs: the mentor name and their parsed schedule: the busy
+        # [start, end) spans in seconds of each weekday and any conflicts
+        # Note that this runs in worker processes when read() is parallel
+
+        # Phase 1: Open the iCal file and retrieve desired data
+        currentPath = join(iCalPath, file)
+        startTimes, endTimes, weekdate, summaries = [], [], [], []
+        eventWeeks = [] # Term weeks of each event, per weekday
+        currentName = split(currentPath)[1][:-self.extensionReduce]
+        self.logger.info(currentName, extra={"event": "readFile", "mentor": currentName})
+        iCalType = None # "SIO" or "NON-SIO", decided from PRODID
+        zuluTime = False # If TRUE, raise alert!
+        calendar = {} # VCALENDAR properties, filled in while streaming
+        timed = self.instrumentation != None
+        if timed:
+            nested = {} # Components inside events, e.g. VALARM -> count
+            eventsSeen = 0
+            wall, cpu = [perf_counter()], [process_time()]
+        else:
+            nested = None
+
+        if content == None:
+            with open(currentPath, 'rb') as icsfile:
+                content = icsfile.read()
+        # iCal files are UTF-8 (RFC 5545 3.1.4)
+        for event in iCal.parseEvents(content.decode("utf-8", "replace"), calendar, nested):
+            if timed:
+                eventsSeen += 1
+            # Check if iCal file is SIO-generated
+            if iCalType == None:
+                iCalType = "SIO"
+                if not calendar.get("PRODID", "").startswith("-CMU SIO"):
+                    iCalType = "NON-SIO"
+                    self.logger.warning("%s's schedule NON SIO-GENERATED!", currentName,
+                                        extra={"event": "nonSIO", "mentor": currentName})
+                    self.logger.info("Exported from: %s", calendar.get("PRODID"),
+                                     extra={"event": "exportedFrom",
+                                            "mentor": currentName})
+            if event.startTime == None or event.endTime == None:
+                continue # All-day events do not block any interval
+            rrule = event.rrule
+            if iCalType == "SIO":
+                if rrule == None: # Found non-weekly event?!
+                    self.logger.warning("WARNING: Non-recurring event detected!",
+                                        extra={"event": "nonRecurring",
+                                               "mentor": currentName})
+            elif zuluTime == False and event.zulu:
+                zuluTime = True
+                self.logger.warning("WARNING: Zulu time detected! "
+                                    "Add 5 hours when importing into calendar",
+                                    extra={"event": "zuluTime",
+                                           "mentor": currentName})
+            # Every occurrence counts for the week-resolved schedule, but
+            # only events that recur through enough of the term count
+            # for the weekly template
+            try:
+                weeksByDay = iCal.occurrenceWeeks(self, event)
+            except ValueError as error:
+                self.logger.warning("WARNING: Skipping %s, invalid recurrence: %s",
+                                    event.summary, error,
+                                    extra={"event": "invalidRecurrence",
+                                           "mentor": currentName})
+                continue
+            weeks = 0 # Bit w set: occurs in term week w
+            for dayWeeks in weeksByDay:
+                weeks |= dayWeeks
+            template = rrule != None and bin(weeks).count("1") >= self.minWeeks
+            if not template and not any(weeksByDay[:5]):
+                continue
+            if template and iCalType == "NON-SIO":
+                if "UNTIL" not in rrule and "COUNT" not in rrule:
+                    self.logger.info("Found weekly event with infinite recurrence.",
+                                     extra={"event": "infiniteRecurrence",
+                                            "mentor": currentName})
+                self.logger.info("Found possible event: %s", event.summary,
+                                 extra={"event": "eventDelivered",
+                                        "mentor": currentName})
+            startTimes.append(event.startTime)
+            endTimes.append(event.endTime)
+            eventWeeks.append(weeksByDay[:5])
+            weekdate.append([day for day in range(5) if weeksByDay[day]]
+                            if template else [])
+            summaries.append(event.summary)
+
+        # print("startTimes:", startTimes)
+        # print("endTimes:", endTimes)
+        # print("weekdates", weekdate)
         
-        currentPath = rootPath + "Monday.csv"
-        with open(currentPath, 'w', newline='') as csvfile:
-            iCalRowWriter = csv.writer(csvfile)
-            iCalRowWriter.writerow(self.header)
-            for row in range(len(self.masterSchedule)):
-                iCalRowWriter.writerow(self.masterSchedule[row][0])
+        if timed:
+            wall.append(perf_counter())
+            cpu.append(process_time())
 
-        currentPath = rootPath + "Tuesday.csv"
-        with open(currentPath, 'w', newline='') as csvfile:
-            iCalRowWriter = csv.writer(csvfile)
-            iCalRowWriter.writerow(self.header)
-            for row in range(len(self.masterSchedule)):
-                # print(self.masterSchedule[row][1])
-                iCalRowWriter.writerow(self.masterSchedule[row][1])
+        # Phase 2/3: Convert HHMMSS stamps into seconds after midnight,
+        # all events of the file at once
+        startTimeSeconds = iCal.secondsBatch(startTimes)
+        endTimesSeconds = iCal.secondsBatch(endTimes)
+        if timed:
+            wall.append(perf_counter())
+            cpu.append(process_time())
+        # print("startSeconds:", startTimeSeconds)   
+        # print("endSeconds:", endTimesSeconds)
 
-        currentPath = rootPath + "Wednesday.csv"
-        with open(currentPath, 'w', newline='') as csvfile:
-            iCalRowWriter = csv.writer(csvfile)
-            iCalRowWriter.writerow(self.header)
-            for row in range(len(self.masterSchedule)):
-                iCalRowWriter.writerow(self.masterSchedule[row][2])
+        # Phase 4: Build the busy intervals
+        # Overlapping events are merged, and reported as conflicts if they
+        # also take place in the same week (a Mini-1 and a Mini-2 course in
+        # the same slot never meet)
+        busySpans = [BusySpans(), BusySpans(), BusySpans(), BusySpans(), BusySpans()]
+        dayEvents = [[], [], [], [], []] # [start, end, weeks] added so far
+        conflicts = []
+        for eventIndex, days in enumerate(weekdate):
+            start, end = startTimeSeconds[eventIndex], endTimesSeconds[eventIndex]
+            for day in days:
+                weeks = eventWeeks[eventIndex][day]
+                overlaps = busySpans[day].add(start, end)
+                if overlaps:
+                    overlaps = any(otherStart < end and start < otherEnd and weeks & otherWeeks
+                                   for otherStart, otherEnd, otherWeeks in dayEvents[day])
+                dayEvents[day].append([start, end, weeks])
+                if overlaps:
+                    conflicts.append([self.weekdayNames[day],
+                                      summaries[eventIndex],
+                                      startTimeSeconds[eventIndex],
+                                      endTimesSeconds[eventIndex]])
+                    self.logger.warning("WARNING: %s overlaps another event on %s!",
+                                        summaries[eventIndex], self.weekdayNames[day],
+                                        extra={"event": "conflict",
+                                               "mentor": currentName})
+        daySpans = [spans.spans() for spans in busySpans]
 
-        currentPath = rootPath + "Thursday.csv"
-        with open(currentPath, 'w', newline='') as csvfile:
-            iCalRowWriter = csv.writer(csvfile)
-            iCalRowWriter.writerow(self.header)
-            for row in range(len(self.masterSchedule)):
-                iCalRowWriter.writerow(self.masterSchedule[row][3])
+        # Phase 4B: Busy intervals per term week, as [start, end, weeks]
+        weekSpans = [[], [], [], [], []]
+        for eventIndex, weeksByDay in enumerate(eventWeeks):
+            for day, weeks in enumerate(weeksByDay):
+                if weeks:
+                    weekSpans[day].append([startTimeSeconds[eventIndex],
+                                           endTimesSeconds[eventIndex], weeks])
 
-        currentPath = rootPath + "Friday.csv"
-        with open(currentPath, 'w', newline='') as csvfile:
-            iCalRowWriter = csv.writer(csvfile)
-            iCalRowWriter.writerow(self.header)
-            for row in range(len(self.masterSchedule)):
-                iCalRowWriter.writerow(self.masterSchedule[row][4])
-
-    def writeToXLSX(self): # xlsxwriter must be installed
-        print("Writing all schedules to 'Moneythink Schedules Tabulation.xlsx'")
-        workbook = xlsxwriter.Workbook('Moneythink Schedules Tabulation.xlsx')
-        mondaySheet = workbook.add_worksheet("Monday")
-        tuesdaySheet = workbook.add_worksheet("Tuesday")
-        wednesdaySheet = workbook.add_worksheet("Wednesday")
-        thursdaySheet = workbook.add_worksheet("Thursday")
-        fridaySheet = workbook.add_worksheet("Friday")
+        parsed = {"spans": daySpans, "conflicts": conflicts, "weekSpans": weekSpans}
+        if timed:
+            # Taken off again by readIter() before the schedule is cached
+            wall.append(perf_counter())
+            cpu.append(process_time())
+            parsed["stats"] = {
+                "phases": [[name, wall[index + 1] - wall[index], cpu[index + 1] - cpu[index]]
+                           for index, name in enumerate(["parse: events", "parse: seconds",
+                                                         "parse: busy spans"])],
+                "counters": {"eventsSeen": eventsSeen,
+                             "eventsDelivered": len(startTimes),
+                             "alarmsSkipped": nested.get("VALARM", 0),
+                             "zuluFiles": int(zuluTime),
+                             "nonSIOFiles": int(iCalType == "NON-SIO"),
+                             "conflicts": len(conflicts)}}
+        return currentName, parsed
+
+    def read(self, workers=1):
+        # Inputs: number of worker processes used to parse the iCals
+        # (None uses every core). Mentors are appended in name order
+        # whatever the worker count, so the outputs are reproducible.
+        with iCal.phase(self, "read", profile=True):
+            for record in iCal.readIter(self, workers):
+                pass
 
+    def readIter(self, workers=1):
+        # Same as read(), but yields (name, busyMasks) for every mentor as
+        # soon as it is added, e.g. a.writeToCSV(a.readIter()) exports
+        # while the iCals are still being parsed.
+        # Files whose contents are already in the cache are not parsed again.
+        # Without workers each file is read, hashed and parsed in turn, so
+        # only one file's bytes are held at a time.
+        with iCal.phase(self, "read: load cache"):
+            files = sorted([file for file in listdir(iCalPath) if iCal.isICalFile(file)],
+                           key=lambda file: file[:-self.extensionReduce])
+            self.schedulesLoaded = True
+            cache = iCal.loadCache(self) if self.useCache else {}
+        hashes, missing = {}, set() # missing: files the workers parse
+        pool = None
+        if workers != 1:
+            # The workers need to know every file to parse up front
+            with iCal.phase(self, "read: hash"):
+                for file in files:
+                    with open(iCalPath + file, 'rb') as icsfile:
+                        hashes[file] = sha1(icsfile.read()).hexdigest()
+            missing = [file for file in files if hashes[file] not in cache]
+        if missing:
+            # Each worker gets its own copy of this iCal once, at start-up;
+            # passing self.parseFile to map() would pickle self again for
+            # every file, and self grows as mentors are added below
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=startWorker,
+                                       initargs=(self, iCalPath, logger.level))
+            parsed = pool.map(parseInWorker, missing, # Results come in order
+                              chunksize=max(1, len(missing) // (8 * (workers or cpu_count() or 1))))
+            missing = set(missing)
+
+        progress = Progress("Reading iCals", len(files), self.showProgress)
+        parsedCount = 0
+        try:
+            for file in files:
+                currentName = file[:-self.extensionReduce]
+                schedule = None
+                if file in missing:
+                    schedule = next(parsed)[1]
+                elif file not in hashes:
+                    with iCal.phase(self, "read: hash"):
+                        with open(iCalPath + file, 'rb') as icsfile:
+                            content = icsfile.read()
+                        hashes[file] = sha1(content).hexdigest()
+                    if hashes[file] not in cache:
+                        schedule = iCal.parseFile(self, file, content)[1]
+                    content = None
+                if schedule != None:
+                    parsedCount += 1
+                    stats = schedule.pop("stats", None)
+                    if stats != None:
+                        iCal.addParseStats(self, currentName, stats)
+                    if self.useCache:
+                        cache[hashes[file]] = schedule
+                else:
+                    schedule = cache[hashes[file]]
+                progress.update()
+                with iCal.phase(self, "read: add mentors"):
+                    busyMasks = iCal.addMentor(self, currentName, schedule)
+                yield currentName, busyMasks
+        finally:
+            if pool != None:
+                pool.shutdown(cancel_futures=True)
+            progress.close()
+        if self.instrumentation != None:
+            self.instrumentation.count("filesParsed", parsedCount)
+            self.instrumentation.count("cacheHits", len(files) - parsedCount)
+        self.logger.info("%d of %d iCals found in the cache.",
+                         len(files) - parsedCount, len(files),
+                         extra={"event": "cacheHits"})
+
+        if self.useCache and (parsedCount or set(cache) != set(hashes.values())):
+            # Entries of files that are gone are dropped here; an unchanged
+            # cache is not written again
+            with iCal.phase(self, "read: save cache"):
+                iCal.saveCache(self, {hashes[file]: cache[hashes[file]]
+                                      for file in files})
+
+    def isICalFile(file):
+        # Outputs: True for "*.ics" file names in any case; anything else in
+        # iCalPath (.gitignore, editor temp files) is not a mentor
+        return file.lower().endswith(".ics")
+
+    def addParseStats(self, currentName, stats):
+        # Adds the "stats" parseFile() returns when instrumented
+        for name, wall, cpu in stats["phases"]:
+            self.instrumentation.addTime(name, wall, cpu)
+        self.instrumentation.files[currentName] = sum(phase[1] for phase in stats["phases"])
+        for name, amount in stats["counters"].items():
+            self.instrumentation.count(name, amount)
+
+    # Snapshot layout, all little-endian: header, then the sections in the
+    # order of snapshotSections, each an (offset, length) pair in the header
+    snapshotMagic = b"MTSNAP"
+    snapshotVersion = 1
+    snapshotSections = ["nameIndex", "names", "masks", "spanIndex", "spans",
+                        "matches", "siteMatches", "sites", "conflicts"]
+    snapshotHeader = struct.Struct("<6sH20sIIHH" + "QQ" * len(snapshotSections))
+
+    def snapshotKey(self):
+        # A snapshot only loads under the same grid, semester and parser
+        settings = [iCal.snapshotVersion, self.cacheVersion, self.grid.key(),
+                    self.semester.key(), self.minWeeks]
+        return sha1(json.dumps(settings).encode()).digest()
+
+    def saveSnapshot(self, currentPath=None):
+        # Writes the schedules, sites and matches in memory to a binary file
+        # that loadSnapshot() maps straight back in (see snapshotSections):
+        # nameIndex  (mentors + 1) uint32 offsets into names
+        # names      UTF-8 mentor names, back to back
+        # masks      one maskBytes busy mask per mentor per weekday
+        # spanIndex  (mentors * 5 + 1) uint32 offsets into spans, in pairs
+        # spans      int32 start, end pairs (exact busy time, see BusySpans)
+        # matches    one siteBytes bitset of matched sites per mentor
+        # siteMatches  the transpose: one bitset of matched mentors per site
+        # sites      JSON list of Site records; conflicts  JSON dictionary
+        if currentPath == None:
+            currentPath = self.snapshotPath
+        mentorCount, siteCount = len(self.mentorNames), len(self.sites)
+        maskBytes = (self.totalIntervals + 7) // 8
+        siteBytes = (siteCount + 7) // 8
+        encodedNames = [name.encode() for name in self.mentorNames]
+        nameIndex = [0]
+        for name in encodedNames:
+            nameIndex.append(nameIndex[-1] + len(name))
+        masks = bytearray()
+        spanIndex, spans = [0], []
+        for index in range(mentorCount):
+            for day in range(5):
+                masks += self.busyMasks[day][index].to_bytes(maskBytes, "little")
+                busySpans = self.busySpans[day][index]
+                for start, end in zip(busySpans.starts, busySpans.ends):
+                    spans += [start, end]
+                spanIndex.append(len(spans) // 2)
+        mentorBytes = (mentorCount + 7) // 8
+        matches = bytearray(mentorCount * siteBytes)
+        siteMatches = bytearray(siteCount * mentorBytes)
+        for siteIndex, site in enumerate(self.sites):
+            for name in self.matchDictionary.get(site.label, ()):
+                index = self.mentorIndex[name]
+                matches[index * siteBytes + siteIndex // 8] |= 1 << siteIndex % 8
+                siteMatches[siteIndex * mentorBytes + index // 8] |= 1 << index % 8
+        sections = [struct.pack("<%dI" % len(nameIndex), *nameIndex),
+                    b"".join(encodedNames), bytes(masks),
+                    struct.pack("<%dI" % len(spanIndex), *spanIndex),
+                    struct.pack("<%di" % len(spans), *spans), bytes(matches),
+                    bytes(siteMatches), json.dumps([list(site) for site in self.sites]).encode(),
+                    json.dumps(self.conflicts).encode()]
+        offsets, offset = [], iCal.snapshotHeader.size
+        for section in sections:
+            offsets += [offset, len(section)]
+            offset += len(section)
+        # The file may be the one still mapped by loadSnapshot(): write a
+        # new file and swap it in, after the mapping is no longer needed
+        iCal.closeSnapshot(self)
+        with open(currentPath + ".tmp", 'wb') as snapshotFile:
+            snapshotFile.write(iCal.snapshotHeader.pack(
+                iCal.snapshotMagic, iCal.snapshotVersion, iCal.snapshotKey(self),
+                mentorCount, siteCount, maskBytes, siteBytes, *offsets))
+            for section in sections:
+                snapshotFile.write(section)
+        replace(currentPath + ".tmp", currentPath)
+        self.logger.info("Snapshot of %d mentors and %d sites written", mentorCount,
+                         siteCount, extra={"event": "snapshotSaved"})
+
+    def loadSnapshot(self, currentPath=None):
+        # Replaces the schedules, sites and matches in memory with those of a
+        # saveSnapshot() file, which is memory-mapped: exact busy spans and
+        # match sets are only decoded when first used.
+        # Outputs: False (and nothing changes) if the file is missing, not a
+        # snapshot, or was written under another grid or semester setting
+        if currentPath == None:
+            currentPath = self.snapshotPath
+        if self.weekResolved:
+            self.logger.info("Snapshots do not hold week-resolved schedules.",
+                             extra={"event": "snapshotInvalid"})
+            return False
+        try:
+            with open(currentPath, 'rb') as snapshotFile:
+                view = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError): # ValueError: empty file
+            return False
+        if len(view) < iCal.snapshotHeader.size:
+            view.close()
+            return False
+        header = iCal.snapshotHeader.unpack_from(view)
+        magic, version, key, mentorCount, siteCount, maskBytes, siteBytes = header[:7]
+        if magic != iCal.snapshotMagic or version != iCal.snapshotVersion:
+            self.logger.info("%s is not a current snapshot, ignoring it.", currentPath,
+                             extra={"event": "snapshotInvalid"})
+            view.close()
+            return False
+        if key != iCal.snapshotKey(self):
+            self.logger.info("Grid or semester settings changed, ignoring the snapshot.",
+                             extra={"event": "snapshotInvalid"})
+            view.close()
+            return False
+        iCal.closeSnapshot(self, decode=False) # Its state is replaced below
+        self.snapshotMap, self.snapshotViews = view, [memoryview(view)]
+        section = {}
+        for index, name in enumerate(iCal.snapshotSections):
+            offset, length = header[7 + 2 * index], header[8 + 2 * index]
+            section[name] = self.snapshotViews[0][offset:offset + length]
+            self.snapshotViews.append(section[name])
+
+        nameIndex = struct.unpack_from("<%dI" % (mentorCount + 1), section["nameIndex"])
+        names = bytes(section["names"])
+        mentorNames = [names[nameIndex[index]:nameIndex[index + 1]].decode()
+                       for index in range(mentorCount)]
+        masks = section["masks"]
+        busyMasks = [[int.from_bytes(masks[(index * 5 + day) * maskBytes:
+                                           (index * 5 + day + 1) * maskBytes], "little")
+                      for index in range(mentorCount)] for day in range(5)]
+        spanIndex = struct.unpack_from("<%dI" % (mentorCount * 5 + 1), section["spanIndex"])
+        spans = section["spans"]
+        # The lists in self change with updates; the lazy builders below
+        # look mentors and sites up by their position in the snapshot
+        snapshotNames = tuple(mentorNames)
+
+        def buildSpans(key): # key = mentor * 5 + day in the snapshot
+            first, last = spanIndex[key], spanIndex[key + 1]
+            values = struct.unpack_from("<%di" % (2 * (last - first)), spans, 8 * first)
+            busySpans = BusySpans()
+            busySpans.starts, busySpans.ends = list(values[0::2]), list(values[1::2])
+            return busySpans
+
+        sites = [Site(*record) for record in json.loads(bytes(section["sites"]))]
+        sites = [site._replace(interval=tuple(site.interval) if site.interval else None)
+                 for site in sites]
+        matches, siteMatches = section["matches"], section["siteMatches"]
+        mentorBytes = (mentorCount + 7) // 8
+
+        def setBits(bits, labels): # Outputs: labels of the set bits
+            chosen = set()
+            while bits:
+                low = bits & -bits
+                chosen.add(labels[low.bit_length() - 1])
+                bits ^= low
+            return chosen
+
+        siteLabels = tuple(site.label for site in sites)
+
+        def buildMentorSites(key): # key = mentor in the snapshot
+            return setBits(int.from_bytes(matches[key * siteBytes:(key + 1) * siteBytes],
+                                          "little"), siteLabels)
+
+        def buildSiteMentors(key): # key = site in the snapshot
+            return setBits(int.from_bytes(siteMatches[key * mentorBytes:
+                                                      (key + 1) * mentorBytes], "little"),
+                           snapshotNames)
+
+        self.mentorNames = mentorNames
+        self.mentorIndex = {name: index for index, name in enumerate(mentorNames)}
+        self.busyMasks = busyMasks
+        self.busySpans = [LazyList(range(day, mentorCount * 5, 5), buildSpans)
+                          for day in range(5)]
+        self.weekMasks = [[], [], [], [], []]
+        self.conflicts = json.loads(bytes(section["conflicts"]))
+        self.sites = sites
+        # Match sets are decoded per mentor / site on first use; sites with
+        # the same detailed name share one set, as in setSiteMatches()
+        self.mentorSites = LazyDict(zip(mentorNames, range(mentorCount)), buildMentorSites)
+        self.matchDictionary = LazyDict({site.label: index for index, site
+                                         in enumerate(sites)}, buildSiteMentors)
+        self.siteCommutes = {site.label: site.commute for site in sites}
+        self.validMentorName = set(mentorNames)
+        self.schedulesLoaded = True
+        self.logger.info("Snapshot of %d mentors and %d sites loaded", mentorCount,
+                         siteCount, extra={"event": "snapshotLoaded"})
+        return True
+
+    def closeSnapshot(self, decode=True):
+        # Closes the memory map of the last loadSnapshot(). With decode,
+        # the busy spans and match sets still waiting in it are decoded
+        # first, into plain lists and dictionaries, so nothing is lost;
+        # without, the caller replaces them.
+        if self.snapshotMap == None:
+            return
+        if decode:
+            self.busySpans = [list(spans) for spans in self.busySpans]
+            self.mentorSites = dict(self.mentorSites.items())
+            self.matchDictionary = dict(self.matchDictionary.items())
+        for view in self.snapshotViews:
+            view.release()
+        self.snapshotMap.close()
+        self.snapshotMap, self.snapshotViews = None, []
+
+    def cacheKey(self):
+        # Any change to these settings invalidates every cached schedule
+        settings = [self.cacheVersion, self.semester.key(), self.minWeeks]
+        return sha1(json.dumps(settings).encode()).hexdigest()
+
+    def loadCache(self):
+        # Outputs: dictionary of file content hash -> parsed schedule
+        try:
+            with open(self.cachePath) as cachefile:
+                cache = json.load(cachefile)
+        except (OSError, ValueError):
+            return {}
+        if cache.get("key") != iCal.cacheKey(self):
+            self.logger.info("Semester settings changed, discarding the cache.",
+                             extra={"event": "cacheInvalidated"})
+            return {}
+        return cache["files"]
+
+    def saveCache(self, files):
+        with open(self.cachePath, 'w') as cachefile:
+            json.dump({"key": iCal.cacheKey(self), "files": files}, cachefile)
+
+    def addMentor(self, currentName, parsed):
+        # Inputs: mentor name and the parsed schedule from parseFile(), i.e.
+        # {"spans": five weekday lists of [start, end], "conflicts": [...]}
+        # Outputs: the mentor's five weekday busy masks on the grid
+        busySpans = [BusySpans(spans) for spans in parsed["spans"]]
+        busyMasks = [iCal.spansMask(self, spans) for spans in busySpans]
+
+        # Phase 7: Append student's intervals to master list, or replace them
+        # if the mentor is already there
+        index = self.mentorIndex.get(currentName)
+        if index == None:
+            index = len(self.mentorNames)
+            self.mentorIndex[currentName] = index
+            self.mentorNames.append(currentName)
+            for day in range(5):
+                self.busyMasks[day].append(None)
+                self.busySpans[day].append(None)
+                if self.weekResolved:
+                    self.weekMasks[day].append(None)
+        for day in range(len(busyMasks)):
+            self.busyMasks[day][index] = busyMasks[day]
+            self.busySpans[day][index] = busySpans[day]
+        self.conflicts.pop(currentName, None)
+        if parsed["conflicts"]:
+            self.conflicts[currentName] = parsed["conflicts"]
+        if self.weekResolved:
+            # Without per-week data (e.g. from readFromCSV()) the weekly
+            # template applies to every teaching week
+            weekSpans = parsed.get("weekSpans") or [
+                [[start, end, self.semester.teachingWeeks] for start, end in spans]
+                for spans in parsed["spans"]]
+            for day in range(5):
+                self.weekMasks[day][index] = iCal.weekMask(self, weekSpans[day])
+        return busyMasks
+
+    def spansMask(self, spans):
+        # Inputs: BusySpans of one mentor and weekday
+        # Outputs: busy mask of those spans on the grid
+        busy = 0
+        for interval in iCal.intervalsBatch(self, spans.starts, spans.ends):
+            busy |= iCal.intervalMask(interval)
+        return busy
+
+    def updateMentor(self, path):
+        # Inputs: path of a new or changed iCal (a file name is looked up in
+        # iCalPath)
+        # Outputs: set of detailed site names the mentor now matches
+        # Only this mentor's row of the match matrix is recomputed, against
+        # the sites of the last matchFromCSV()
+        currentName, parsed = iCal.parseFile(self, path)
+        index = self.mentorIndex.get(currentName)
+        iCal.addMentor(self, currentName, parsed)
+        self.schedulesLoaded = True
+        if index == None:
+            self.logger.info("Added %s", currentName,
+                             extra={"event": "mentorAdded", "mentor": currentName})
+        self.validMentorName.add(currentName)
+        iCal.matchMentor(self, currentName)
+        return set(self.mentorSites.get(currentName, ()))
+
+    def removeMentor(self, currentName):
+        # Removes a mentor's schedule and matches. Returns False if the
+        # mentor is unknown.
+        index = self.mentorIndex.pop(currentName, None)
+        if index == None:
+            self.logger.warning("Invalid mentor name entered: %s", currentName,
+                                extra={"event": "invalidMentor", "mentor": currentName})
+            return False
+        del self.mentorNames[index]
+        for day in range(5):
+            del self.busyMasks[day][index]
+            del self.busySpans[day][index]
+            if self.weekMasks[day]:
+                del self.weekMasks[day][index]
+        for name in self.mentorNames[index:]:
+            self.mentorIndex[name] -= 1
+        self.conflicts.pop(currentName, None)
+        self.validMentorName.discard(currentName)
+        for site in self.mentorSites.pop(currentName, ()):
+            self.matchDictionary[site].discard(currentName)
+        for coverage in self.weekCoverages.values():
+            coverage.pop(currentName, None)
+        for assigned in self.assignments.values():
+            if currentName in assigned:
+                assigned.remove(currentName)
+        self.logger.info("Removed %s", currentName,
+                         extra={"event": "mentorRemoved", "mentor": currentName})
+        return True
+
+    def matchMentor(self, currentName):
+        # Recomputes one mentor's row of the match matrix against self.sites
+        index = self.mentorIndex[currentName]
+        for site in self.sites:
+            if site.mask & self.busyMasks[site.day][index]:
+                self.matchDictionary[site.label].discard(currentName)
+                self.mentorSites.get(currentName, set()).discard(site.label)
+            else:
+                self.matchDictionary[site.label].add(currentName)
+                self.mentorSites.setdefault(currentName, set()).add(site.label)
+            if self.weekResolved:
+                coverage = self.weekCoverages[site.label]
+                coverage.pop(currentName, None)
+                weeks = iCal.freeWeeks(self, self.weekMasks[site.day][index],
+                                       site.interval)
+                if weeks:
+                    coverage[currentName] = weeks
+
+    def weekMask(self, weekSpans):
+        # Inputs: list of [start, end, weeks] for one weekday, where bit w of
+        # weeks is set if the event takes place in term week w
+        # Outputs: bit-packed busy matrix of that weekday; bit i * W + w is
+        # set if interval i is busy in week w (W = number of term weeks)
+        weekCount = self.semester.weekCount
+        spans = iCal.intervalsBatch(self, [span[0] for span in weekSpans],
+                                    [span[1] for span in weekSpans])
+        busy = 0
+        for interval, (start, end, weeks) in zip(spans, weekSpans):
+            if interval != None:
+                # weeks times this repeats it once per interval of the span
+                repeat = (((1 << ((interval[1] - interval[0] + 1) * weekCount)) - 1) //
+                          ((1 << weekCount) - 1))
+                busy |= weeks * repeat << (interval[0] * weekCount)
+        return busy
+
+    def weekCoverage(self, day, interval):
+        # Inputs: weekday index (Monday = 0) and (startInterval,
+        # endInterval) span needed by a site
+        # Outputs: dictionary of mentor -> number of teaching weeks in which
+        # the mentor is free for the whole span (mentors with none left out)
+        coverage = {}
+        for mentor, busy in zip(self.mentorNames, self.weekMasks[day]):
+            weeks = iCal.freeWeeks(self, busy, interval)
+            if weeks:
+                coverage[mentor] = weeks
+        return coverage
+
+    def freeWeeks(self, busy, interval):
+        # Inputs: one mentor's weekMask() of a weekday and an interval span
+        # Outputs: number of teaching weeks in which the whole span is free
+        weekCount = self.semester.weekCount
+        teachingWeeks = self.semester.teachingWeeks
+        if interval == None:
+            return bin(teachingWeeks).count("1")
+        chunks = interval[1] - interval[0] + 1
+        busy = (busy >> (interval[0] * weekCount)) & ((1 << (chunks * weekCount)) - 1)
+        # OR the intervals' week rows together by repeated halving
+        while chunks > 1:
+            half = (chunks + 1) // 2
+            busy = (busy & ((1 << (half * weekCount)) - 1)) | (busy >> (half * weekCount))
+            chunks = half
+        return bin(teachingWeeks & ~busy).count("1")
+
+    def maskSpans(self, busy):
+        # Outputs: [start, end] spans in seconds of each run of busy intervals
+        spans, interval = [], 0
+        while busy >> interval:
+            if busy >> interval & 1:
+                first = interval
+                while busy >> interval & 1:
+                    interval += 1
+                spans.append([self.grid.start + first * self.grid.slotLength,
+                              self.grid.start + interval * self.grid.slotLength])
+            else:
+                interval += 1
+        return spans
+
+    def isFree(self, mentor, day, start, end):
+        # Inputs: mentor name, weekday index (Monday = 0) and a time range
+        # in seconds after midnight, independent of the grid
+        # Outputs: True if none of the mentor's events overlap [start, end)
+        return self.busySpans[day][self.mentorIndex[mentor]].isFree(start, end)
+
+    def scheduleRow(self, currentName, busy):
+        # Outputs: one weekday row of the exports; empty space means busy
+        return [currentName if not busy >> i & 1 else ""
+                for i in range(self.totalIntervals)]
+
+    def readHeader(self):
+        # The intervals format comes from the grid; Template.csv holds the
+        # same labels for the default grid, so it is no longer read
+        self.header = self.grid.labels()
+        return self.header
+
+    def writeToCSV(self, records=None, longPath=None):
+        # Run this function if xlsxwriter is not installed
+        # Inputs: iterable of (name, busyMasks) records, by default every
+        # mentor in memory (it may be readIter(), see read()), and optional
+        # path of a combined file with one (mentor, day, interval, free) row
+        # per interval. All five weekday files are written in one pass.
+        self.logger.info("Writing all schedules to CSV", extra={"event": "writeCSV"})
+        iCal.readHeader(self)
+        # print(self.header)
+        if records == None:
+            records = zip(self.mentorNames, zip(*self.busyMasks))
+
+        with ExitStack() as stack:
+            dayWriters = []
+            for dayName in self.weekdayNames:
+                csvfile = stack.enter_context(open(rootPath + dayName + ".csv", 'w',
+                                                   newline=''))
+                dayWriters.append(csv.writer(csvfile))
+                dayWriters[-1].writerow(self.header)
+            longWriter = None
+            if longPath != None:
+                longWriter = csv.writer(stack.enter_context(open(longPath, 'w',
+                                                                 newline='')))
+                longWriter.writerow(["mentor", "day", "interval", "free"])
+            for currentName, busyMasks in records:
+                for day, busy in enumerate(busyMasks):
+                    dayWriters[day].writerow(iCal.scheduleRow(self, currentName, busy))
+                    if longWriter != None:
+                        longWriter.writerows([currentName, self.weekdayNames[day],
+                                              self.header[i], 0 if busy >> i & 1 else 1]
+                                             for i in range(self.totalIntervals))
+
+    def writeToXLSX(self, currentPath='Moneythink Schedules Tabulation.xlsx'):
+        # xlsxwriter must be installed
+        # Rows are streamed to disk (constant_memory), so every sheet is
+        # written top to bottom in one go. Busy (blank) and free cells are
+        # coloured by two conditional formats per sheet, not cell by cell.
+        self.logger.info("Writing all schedules to '%s'", currentPath,
+                         extra={"event": "writeXLSX"})
+        import xlsxwriter
+        workbook = xlsxwriter.Workbook(currentPath, {'constant_memory': True})
         bold = workbook.add_format({'bold': True})
+        busyFormat = workbook.add_format({'bg_color': '#FFC7CE'})
+        freeFormat = workbook.add_format({'bg_color': '#C6EFCE'})
 
-        mondaySheet.freeze_panes(1, 0)
-        tuesdaySheet.freeze_panes(1, 0)
-        wednesdaySheet.freeze_panes(1, 0)
-        thursdaySheet.freeze_panes(1, 0)
-        fridaySheet.freeze_panes(1, 0)
+        iCal.readHeader(self)
 
-        # Retrieve half-hour intervals format from the template
-        currentPath = rootPath + "Template.csv"
-        with open(currentPath, newline='') as csvfile:
-            templateReader = csv.reader(csvfile)
-            for row in templateReader:
-                self.header = row
-        for row in range(len(self.masterSchedule) + 1):
-            if row == 0: # Write in the half-hour intervals
-                for col in range(self.totalIntervals):
-                    mondaySheet.write(0, col, self.header[col], bold)
-                    tuesdaySheet.write(0, col, self.header[col], bold)
-                    wednesdaySheet.write(0, col, self.header[col], bold)
-                    thursdaySheet.write(0, col, self.header[col], bold)
-                    fridaySheet.write(0, col, self.header[col], bold)
-            elif row > 0: # Write in the names
-                for col in range(self.totalIntervals):
-                    mondaySheet.write(row, col, self.masterSchedule[row - 1][0][col])
-                    tuesdaySheet.write(row, col, self.masterSchedule[row - 1][1][col])
-                    wednesdaySheet.write(row, col, self.masterSchedule[row - 1][2][col])
-                    thursdaySheet.write(row, col, self.masterSchedule[row - 1][3][col])
-                    fridaySheet.write(row, col, self.masterSchedule[row - 1][4][col])
-
-    def matchFromCSV(self):
-        currentPath = rootPath + "Site Times Input.csv"
-        analysisDetected = False
+        lastRow, lastCol = len(self.mentorNames), self.totalIntervals - 1
+        for day, dayName in enumerate(self.weekdayNames):
+            sheet = workbook.add_worksheet(dayName)
+            sheet.freeze_panes(1, 0)
+            # Write in the half-hour intervals, then the names
+            sheet.write_row(0, 0, self.header, bold)
+            for row, (currentName, busy) in enumerate(zip(self.mentorNames,
+                                                          self.busyMasks[day])):
+                sheet.write_row(row + 1, 0, iCal.scheduleRow(self, currentName, busy))
+            if lastRow > 0:
+                sheet.conditional_format(1, 0, lastRow, lastCol,
+                                         {'type': 'blanks', 'format': busyFormat})
+                sheet.conditional_format(1, 0, lastRow, lastCol,
+                                         {'type': 'no_blanks', 'format': freeFormat})
+        workbook.close()
 
-        with open(currentPath, newline='') as csvfile:
-            siteReader = csv.reader(csvfile)
-            for rowIndex, row in enumerate(siteReader):
-                if rowIndex == 1:
-                    if len(self.analysisSet & set(row)) > 0:
-                        analysisDetected = True
-                        analysisIndices = set()
-                        for weekdate in range(len(row)):
-                            if row[weekdate] in self.analysisSet:
-                                analysisIndices.add(weekdate)
-            # print(analysisIndices)
-
-        # These 2D-lists should have as many sublists as Site Times Input.csv
-        # has rows
-        originalSiteOrder = []
-        nonAnalysisSites = [[], [], [], [], []]
-        analysisSites = [[], [], [], [], []]
-        workWeekDays = ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY"]
-        if analysisDetected: 
-            # Then, reformat the CSV to put the analysis sites on the rightmost
-            # column
-            with open(currentPath, newline='') as csvfile:
-                siteReader = csv.reader(csvfile)
-                for rowIndex, row in enumerate(siteReader):
-                    originalSiteOrder.append(row)
-                    for siteIndex, site in enumerate(row):
-                        if siteIndex in analysisIndices:
-                            # Placeholder column
-                            if rowIndex == 0: analysisSites[0].append("")
-                            elif rowIndex == 1: analysisSites[1].append("     ")
-                            elif rowIndex == 2: analysisSites[2].append("100")
-                            elif rowIndex == 3: analysisSites[3].append("101")
-                            elif rowIndex == 4: analysisSites[4].append("9999")
-                            for i in range(5): # MO, TU, WE, TH, FR, is 5 days
-                                if rowIndex == 1: # row 1 category is weekdays
-                                    analysisSites[rowIndex].append(workWeekDays[i])
-                                else:
-                                    analysisSites[rowIndex].append(site)
-                        else:
-                            nonAnalysisSites[rowIndex].append(site)
-            # print("nonAnalysisSites:", nonAnalysisSites)
-            # print("analysisSites:", analysisSites)
-            newCSVRows = []
-            for category in range(len(analysisSites)):
-                newCSVRows.append(nonAnalysisSites[category] + analysisSites[category])
-            # print("newCSVRows:", newCSVRows)
-            with open(currentPath, 'w', newline='') as csvfile:
-                newInputWriter = csv.writer(csvfile)
-                for row in range(len(analysisSites)):
-                    newInputWriter.writerow(newCSVRows[row])
+    def readFromCSV(self):
+        # Rebuilds the in-memory schedules from Monday.csv ... Friday.csv
+        # for sessions that did not call read(). Each file is parsed once.
+        self.logger.info("Reading all schedules from CSV", extra={"event": "readCSV"})
+        names, dayRows = [], []
+        for dayName in self.weekdayNames:
+            with open(rootPath + dayName + ".csv", newline='') as csvfile:
+                timeReader = csv.reader(csvfile)
+                next(timeReader) # Skip the header
+                dayRows.append(list(timeReader))
+        for rowIndex in range(len(dayRows[0])):
+            # A mentor who is busy all day has an empty row in that file
+            currentName = ""
+            for rows in dayRows:
+                for name in set(rows[rowIndex]) - set(['']):
+                    currentName = name
+            names.append(currentName)
+        iCal.closeSnapshot(self) # Keeps the snapshot's match sets
+        self.mentorNames, self.mentorIndex = [], {}
+        self.busyMasks = [[], [], [], [], []]
+        self.busySpans = [[], [], [], [], []]
+        self.weekMasks = [[], [], [], [], []]
+        self.schedulesLoaded = True
+        for rowIndex, currentName in enumerate(names):
+            daySpans = []
+            for rows in dayRows:
+                row = rows[rowIndex]
+                busy = 0
+                for i in range(self.totalIntervals):
+                    if row[i] == "":
+                        busy |= 1 << i
+                daySpans.append(iCal.maskSpans(self, busy))
+            iCal.addMentor(self, currentName, {"spans": daySpans, "conflicts": []})
+
+    def weekdayIndex(self, weekday):
+        # Inputs: weekday as written in the site file ("Mon", "TUES", ...)
+        # Outputs: weekday index (Monday = 0), or None if not recognised
+        return self.weekdayAliases.get(weekday.strip().lower())
 
+    def loadSites(self, currentPath=None):
+        # Inputs: path of the site file (default Site Times Input.csv), with
+        # rows Name, Weekday, Start time (HHMM), End time (HHMM) and
+        # Commuting minutes and one column per site
+        # Outputs: list of Site records, Analysis sites expanded. Invalid
+        # cells, rows of different lengths, sites that do not end after
+        # they start and sites whose window (commute included) misses the
+        # grid raise ValueError. The records hold grid intervals, so load
+        # again after setGrid(); otherwise they can be passed to any number
+        # of matchFromCSV(sites=...) runs.
+        if currentPath == None:
+            currentPath = rootPath + "Site Times Input.csv"
         with open(currentPath, newline='') as csvfile:
-            siteReader = csv.reader(csvfile)
-            for rowIndex, row in enumerate(siteReader):
-                # Determine number of sites
-                if rowIndex == 0:
-                    siteCount = 0
-                    for column in row:
-                        if column not in ["Name:", ""]:
-                            siteCount += 1
-                    siteNames = row[1:]
-                    print(str(siteCount) + " sites retrieved.")
-                    # print("Site Names:", siteNames)
-                # Determine the weekday of each site
-                elif rowIndex == 1:
-                    siteWeekdays = row[1:]
-                    # print("Site Weekdays:", siteWeekdays)
-                # Build the original and seconds after midnight start times of each site
-                elif rowIndex == 2:
-                    siteOriginalStart = row[1:]
-                    siteStarts = []
-                    for originalStart in siteOriginalStart:
-                        currentStartTime = originalStart + "00"
-                        siteStarts.append(iCal.secondstime(int(currentStartTime)))
-                    # print("Original start times:", siteOriginalStart)
-                    # print("Seconds start times:", siteStarts)
-                # " end times of each site
-                elif rowIndex == 3:
-                    siteOriginalEnd = row[1:]
-                    siteEnds = []
-                    for originalEnd in siteOriginalEnd:
-                        currentEndTime = originalEnd + "00"
-                        siteEnds.append(iCal.secondstime(int(currentEndTime)))
-                    # print("Original end times:", siteOriginalEnd)
-                    # print("Seconds end times:", siteEnds)
-                # Determine the time it takes to commute to each site
-                elif rowIndex == 4:
-                    siteTolerances = row[1:]
-                    # print("Commuting minutes:", siteTolerances)
-                    for minuteIndex, minute in enumerate(siteTolerances):
-                        siteTolerances[minuteIndex] = int(siteTolerances[minuteIndex]) * 60
-                    # print("Commuting seconds:", siteTolerances)
-        adjustedStarts, adjustedEnds = [], []
-        for site in range(len(siteNames)):
-            adjustedStarts.append(siteStarts[site] - siteTolerances[site])
-            adjustedEnds.append(siteEnds[site] + siteTolerances[site])
-        # print("Adjusted start times (seconds after midnight):", adjustedStarts)
-        # print("Adjusted end times (seconds after midnight):", adjustedEnds)
-        siteIntervals = []
-        detailedSiteName = []
-        for site in range(len(siteNames)):
-            siteIntervals.append(iCal.findInterval(self,
-                                             adjustedStarts[site],
-                                             adjustedEnds[site]))
-            detailedSiteName.append("%s %s" % (siteNames[site], siteWeekdays[site]))
-        # print("Site Intervals:", siteIntervals)
-        # print("Detailed Site Name:", detailedSiteName)
+            siteRows = list(csv.reader(csvfile))[:5]
+        if len(siteRows) < 5:
+            raise ValueError("%s: expected 5 rows, found %d" % (currentPath, len(siteRows)))
+        # zip() would quietly drop every site past the shortest row
+        if len(set(len(row) for row in siteRows)) > 1:
+            raise ValueError("%s: rows have different numbers of cells (%s)" % (
+                currentPath, ", ".join(str(len(row)) for row in siteRows)))
+        # Columns of the site file, each [name, weekday, start, end, commute]
+        siteColumns = [list(column) for column in zip(*siteRows)][1:]
+        return iCal.makeSites(self, siteColumns, currentPath)
 
-        masterMatches = []
-        for site in range(len(siteNames)):
-            currentMatches = []
-            adjustedStartIndex = siteIntervals[site][0]
-            adjustedEndIndex = siteIntervals[site][-1]
-            sleep(0.1)
-            if detailedSiteName[site] != "      ":
-                print("Matching %s" % detailedSiteName[site])
+    def makeSites(self, siteColumns, source="site"):
+        # Inputs: list of [name, weekday, start (HHMM), end (HHMM), commuting
+        # minutes] string lists and where they come from (for errors)
+        # Outputs: list of Site records, see loadSites()
+        rowNames = ["name", "weekday", "start time", "end time", "commuting minutes"]
+        # Analysis sites are expanded in memory (the site file is never
+        # modified): they move to the rightmost columns, each as a
+        # contingency placeholder followed by one copy per work weekday
+        columns, analysisColumns = [], []
+        for column in siteColumns:
+            column = [str(cell) for cell in column]
+            for row in (2, 3, 4):
+                column[row] = column[row].strip()
+                if not column[row].isdigit():
+                    raise ValueError("%s: site %r has invalid %s %r" % (
+                        source, column[0], rowNames[row], column[row]))
+            for row in (2, 3):
+                column[row] = column[row].zfill(4)
+                if len(column[row]) != 4 or column[row][:2] > "23" or column[row][2:] > "59":
+                    raise ValueError("%s: site %r has invalid %s %r" % (
+                        source, column[0], rowNames[row], column[row]))
+            if column[3] <= column[2]:
+                raise ValueError("%s: site %r ends (%s) no later than it starts (%s)" % (
+                    source, column[0], column[3], column[2]))
+            if column[1].strip().lower() in self.analysisSet:
+                analysisColumns.append(["", "     ", "0100", "0101", "9999", 4])
+                for day, dayName in enumerate(self.weekdayNames):
+                    analysisColumns.append([column[0], dayName.upper()] + column[2:] + [day])
             else:
-                print("Performing contingency analysis...")
-            if siteWeekdays[site] in self.mondaySet:
-                currentPath = rootPath + "Monday.csv"
-            elif siteWeekdays[site] in self.tuesdaySet:
-                currentPath = rootPath + "Tuesday.csv"
-            elif siteWeekdays[site] in self.wednesdaySet:
-                currentPath = rootPath + "Wednesday.csv"
-            elif siteWeekdays[site] in self.thursdaySet:
-                currentPath = rootPath + "Thursday.csv"
-            elif siteWeekdays[site] in self.fridaySet:
-                currentPath = rootPath + "Friday.csv"
-            elif siteWeekdays[site] == "     ": # Blank column placeholder
-                currentPath = rootPath + "Friday.csv"
-            with open(currentPath, newline='') as csvfile:
-                timeReader = csv.reader(csvfile)
-                for rowIndex, row in enumerate(timeReader):
-                    if site == 1 and rowIndex > 0: # append mentor names to set
-                        self.validMentorName |= (set(row) - set(['']))
-                    if rowIndex > 0:
-                        for name in set(row) - set(['']):
-                            currentName = name
-                        intervalSet = set(row[adjustedStartIndex:adjustedEndIndex + 1])
-                        # print(currentName)
-                        # print(intervalSet)
-                        # If the set's length is 2, this means that a schedule
-                        # is partly free for that interval and partly busy
-                        # If the set's length is 1, this either means that
-                        # the schedule is entirely free for that interval
-                        # or is entirely busy for that interval
-                        if len(intervalSet) == 1:
-                            if intervalSet != set(['']):
-                                currentMatches.append(currentName)
-            # print("currentMatches:", currentMatches)
-            # Append site matches to matches master list
-            masterMatches.append(currentMatches)
+                day = iCal.weekdayIndex(self, column[1])
+                if day == None:
+                    raise ValueError("%s: site %r has unknown weekday %r" % (
+                        source, column[0], column[1]))
+                columns.append(column + [day])
+        columns += analysisColumns
+
+        # Seconds after midnight start and end times of each site, widened by
+        # the time it takes to commute there
+        starts = iCal.secondsBatch([column[2] + "00" for column in columns])
+        ends = iCal.secondsBatch([column[3] + "00" for column in columns])
+        commutes = [int(column[4]) for column in columns]
+        intervals = iCal.intervalsBatch(self,
+                                        [start - commute * 60 for start, commute in zip(starts, commutes)],
+                                        [end + commute * 60 for end, commute in zip(ends, commutes)])
+        sites = []
+        for index, column in enumerate(columns):
+            # An empty mask would make every mentor look free
+            if intervals[index] == None:
+                raise ValueError("%s: site %r (%s-%s plus %s commuting minutes) lies "
+                                 "outside the grid (%02d%02d-%02d%02d)" % (
+                                     source, column[0], column[2], column[3], column[4],
+                                     self.grid.start // 3600, self.grid.start // 60 % 60,
+                                     self.grid.end // 3600, self.grid.end // 60 % 60))
+            sites.append(Site("%s %s" % (column[0], column[1]), column[0], column[1],
+                              starts[index], ends[index], commutes[index], column[5],
+                              intervals[index], iCal.intervalMask(intervals[index])))
+        return sites
+
+    def matchFromCSV(self, writeMatches=True, sites=None):
+        # Matches every site in Site Times Input.csv (or the Site records from
+        # loadSites() given in sites) against the schedules in memory.
+        # Matches.csv is only written if writeMatches is True.
+        with iCal.phase(self, "matchFromCSV", profile=True):
+            if sites == None:
+                with iCal.phase(self, "match: load sites"):
+                    sites = iCal.loadSites(self)
+            iCal.matchSites(self, sites, writeMatches)
+
+    def matchSites(self, sites, writeMatches):
+        # Body of matchFromCSV()
+        self.sites = list(sites) # Kept for updateMentor() and updateSite()
+        # Sites no longer in the list must not keep their old matches
+        labels = set(site.label for site in self.sites)
+        for label in [label for label in self.matchDictionary if label not in labels]:
+            iCal.dropSite(self, label)
+        siteCount = len([site for site in sites if site.name != ""])
+        self.logger.info("%d sites retrieved.", siteCount,
+                         extra={"event": "sitesRetrieved"})
+        if not self.schedulesLoaded:
+            with iCal.phase(self, "match: read schedules from CSV"):
+                iCal.readFromCSV(self)
+        self.validMentorName |= set(self.mentorNames)
+
+        masterMatches = []
+        progress = Progress("Matching sites", len(sites), self.showProgress)
+        with iCal.phase(self, "match: sites"):
+            for site in sites:
+                if site.label != "      ":
+                    self.logger.info("Matching %s", site.label,
+                                     extra={"event": "matchSite", "site": site.label})
+                else:
+                    self.logger.info("Performing contingency analysis...",
+                                     extra={"event": "matchSite", "site": site.label})
+                progress.update()
+                currentMatches = iCal.availableMentors(self, site.day, site.mask)
+                if self.weekResolved:
+                    self.weekCoverages[site.label] = iCal.weekCoverage(
+                        self, site.day, site.interval)
+                # print("currentMatches:", currentMatches)
+                # Append site matches to matches master list
+                masterMatches.append(currentMatches)
+        progress.close()
+        if self.instrumentation != None:
+            self.instrumentation.count("sitesMatched", len(sites))
+            self.instrumentation.count("matchCells", len(sites) * len(self.mentorNames))
 
         # print("MasterMatches", masterMatches)
         # Create the match dictionary for use when determining
         # what sites an individual mentor can be allotted to
-        for siteIndex, site in enumerate(detailedSiteName):
-            self.matchDictionary[site] = set(masterMatches[siteIndex])
+        for siteIndex, site in enumerate(sites):
+            iCal.setSiteMatches(self, site.label, masterMatches[siteIndex])
+            self.siteCommutes[site.label] = site.commute
         # print("Match Dictionary:", self.matchDictionary)
 
-        # Transpose the matches master list for inputting into CSV row-by-row
+        if writeMatches:
+            with iCal.phase(self, "match: write"):
+                iCal.writeMatchFiles(self)
+
+    def writeMatchFiles(self):
+        # Writes Matches.csv (and Week Coverage.csv if weekResolved) for the
+        # sites of the last matchFromCSV(), with the mentors of every site in
+        # name order whatever order they were added in
+        labels = [site.label for site in self.sites]
+        mentors = sorted(self.mentorNames)
+        iCal.writeColumns(rootPath + "Matches.csv", labels,
+                          [[mentor for mentor in mentors if mentor in self.matchDictionary[label]]
+                           for label in labels])
+        if self.weekResolved:
+            iCal.writeWeekCoverage(self, rootPath + "Week Coverage.csv", labels)
+
+    def updateSite(self, name, weekday, start, end, commute):
+        # Inputs: one site as in a column of the site file, e.g.
+        # a.updateSite("Perry", "Friday", "1530", "1630", 15)
+        # Outputs: list of (detailed site name, matched mentors), one entry
+        # unless weekday is Analysis. Only these columns of the match
+        # matrix are recomputed; a site with the same detailed name is
+        # replaced, otherwise the site is added.
+        results = []
+        for site in iCal.makeSites(self, [[name, weekday, start, end, commute]]):
+            labels = [other.label for other in self.sites]
+            if site.label in labels:
+                self.sites[labels.index(site.label)] = site
+            else:
+                self.sites.append(site)
+            currentMatches = iCal.availableMentors(self, site.day, site.mask)
+            iCal.setSiteMatches(self, site.label, currentMatches)
+            self.siteCommutes[site.label] = site.commute
+            if self.weekResolved:
+                self.weekCoverages[site.label] = iCal.weekCoverage(
+                    self, site.day, site.interval)
+            self.logger.info("Matching %s", site.label,
+                             extra={"event": "matchSite", "site": site.label})
+            results.append((site.label, currentMatches))
+        return results
+
+    def removeSite(self, label):
+        # Removes a site (by detailed site name) and its matches. Returns
+        # False if the site is unknown.
+        if label not in self.matchDictionary:
+            self.logger.warning("Invalid site name entered: %s", label,
+                                extra={"event": "invalidSite", "site": label})
+            return False
+        iCal.dropSite(self, label)
+        self.sites = [site for site in self.sites if site.label != label]
+        return True
+
+    def dropSite(self, label):
+        # Forgets everything stored for a site: its matches (in both
+        # directions), commute, week coverage, assignment and teams
+        iCal.setSiteMatches(self, label, [])
+        del self.matchDictionary[label]
+        self.siteCommutes.pop(label, None)
+        self.weekCoverages.pop(label, None)
+        self.assignments.pop(label, None)
+        self.teams.pop(label, None)
+
+    def scanFiles(self):
+        # Outputs: dictionary of iCal file name -> (modification time, size)
+        # for every iCal in iCalPath, plus the site file under the key None
+        stamps = {}
+        for entry in scandir(iCalPath):
+            if entry.is_file() and iCal.isICalFile(entry.name):
+                status = entry.stat()
+                stamps[entry.name] = (status.st_mtime_ns, status.st_size)
+        try:
+            status = stat(rootPath + "Site Times Input.csv")
+            stamps[None] = (status.st_mtime_ns, status.st_size)
+        except OSError:
+            pass
+        return stamps
+
+    def watch(self, interval=0.25, debounce=0.25, workers=1, xlsx=False, stop=None):
+        # Keeps the schedules in memory and polls iCalPath and the site file
+        # every interval seconds. Once a burst of changes has been quiet for
+        # debounce seconds, only the added or changed iCals are parsed again,
+        # removed ones are dropped, and Matches.csv and the weekday CSVs (and
+        # the XLSX if xlsx is True) are rewritten. Runs until Ctrl+C or
+        # until stop(), if given, returns True.
+        if not self.schedulesLoaded:
+            iCal.read(self, workers)
+        try:
+            iCal.matchFromCSV(self, writeMatches=False)
+        except (OSError, ValueError) as error: # Matched once the file is fixed
+            self.logger.warning("Could not read the site file: %s", error,
+                                extra={"event": "watchError"})
+        iCal.writeWatchOutputs(self, xlsx)
+        seen = iCal.scanFiles(self)
+        self.logger.info("Watching %s for changes", iCalPath,
+                         extra={"event": "watchStart"})
+        try:
+            while stop == None or not stop():
+                sleep(interval)
+                current = iCal.scanFiles(self)
+                if current == seen:
+                    continue
+                # Wait for the burst to settle before touching anything
+                while True:
+                    sleep(debounce)
+                    settled = iCal.scanFiles(self)
+                    if settled == current:
+                        break
+                    current = settled
+                iCal.applyChanges(self, seen, current)
+                iCal.writeWatchOutputs(self, xlsx)
+                seen = current
+        except KeyboardInterrupt:
+            pass
+        self.logger.info("Stopped watching", extra={"event": "watchStop"})
+
+    def applyChanges(self, seen, current):
+        # Brings the in-memory state from the scanFiles() result seen up to
+        # date with current. A file that fails to parse (e.g. still being
+        # copied) is logged and picked up again once it changes.
+        files = sorted(set(seen) | set(current), key=lambda file: file or "")
+        for file in files:
+            if file == None or seen.get(file) == current.get(file):
+                continue
+            currentName = file[:-self.extensionReduce]
+            if file not in current:
+                iCal.removeMentor(self, currentName)
+                continue
+            try:
+                iCal.updateMentor(self, file)
+            except Exception as error:
+                self.logger.warning("Could not read %s: %s", file, error,
+                                    extra={"event": "watchError", "mentor": currentName})
+        if seen.get(None) != current.get(None):
+            try:
+                iCal.matchFromCSV(self, writeMatches=False)
+            except (OSError, ValueError) as error:
+                self.logger.warning("Could not read the site file: %s", error,
+                                    extra={"event": "watchError"})
+
+    def writeWatchOutputs(self, xlsx):
+        # Rewrites every export of the in-memory state, mentors in name order
+        order = sorted(range(len(self.mentorNames)), key=self.mentorNames.__getitem__)
+        iCal.writeToCSV(self, [(self.mentorNames[index],
+                                [self.busyMasks[day][index] for day in range(5)])
+                               for index in order])
+        iCal.writeMatchFiles(self)
+        if xlsx:
+            iCal.writeToXLSX(self, rootPath + "Moneythink Schedules Tabulation.xlsx")
+
+    def writeWeekCoverage(self, currentPath, sites):
+        # Inputs: output path and detailed site names, in column order
+        # Outputs: CSV of mentors (rows) by sites (columns), each cell the
+        # number of teaching weeks the mentor can cover that site
+        with open(currentPath, "w", newline="") as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(["Mentor"] + sites)
+            for mentor in sorted(self.mentorNames):
+                writer.writerow([mentor] + [self.weekCoverages[site].get(mentor, 0)
+                                            for site in sites])
+
+    def writeColumns(currentPath, header, columns):
+        # Writes a CSV with one column per header entry, each column holding
+        # the names in the matching list of columns (as in Matches.csv)
+        # Transpose the lists for inputting into CSV row-by-row
         # Determine size of square
         maxLen = 0
-        for site in masterMatches:
-            if len(site) > maxLen:
-                maxLen = len(site)
-
-        # Square the list (make the list N by N)
-        for i in range(len(masterMatches)):
-            currentLen = len(masterMatches[i])
-            for j in range(maxLen - currentLen):
-                masterMatches[i].append("")
-        # print("Squared masterMatches:", masterMatches)
-
-        # Perform the transposition
+        for column in columns:
+            if len(column) > maxLen:
+                maxLen = len(column)
+
+        # Square the list (make the list N by N), then transpose it
         transpose = []
         for row in range(maxLen):
             transpose.append([])
-            for col in range(len(masterMatches)):
-                transpose[row].append(masterMatches[col][row])
-        # print("Transposed masterMatches:", transpose)
+            for column in columns:
+                transpose[row].append(column[row] if row < len(column) else "")
 
-        currentPath = rootPath + "Matches.csv"
         with open(currentPath, 'w', newline='') as csvfile:
-            matchesWriter = csv.writer(csvfile)
-            matchesWriter.writerow(detailedSiteName)
+            columnWriter = csv.writer(csvfile)
+            columnWriter.writerow(header)
             for row in range(len(transpose)):
-                matchesWriter.writerow(transpose[row])
+                columnWriter.writerow(transpose[row])
 
-        if analysisDetected: 
-            currentPath = rootPath + "Site Times Input.csv"
-            with open(currentPath, 'w', newline='') as csvfile:
-                originalInputWriter = csv.writer(csvfile)
-                for row in range(len(originalSiteOrder)):
-                    originalInputWriter.writerow(originalSiteOrder[row])
+    def assign(self, siteCapacity=1, mentorLoad=1, minCost=False,
+               writeAssignments=True):
+        # Inputs: mentors each site takes and sites each mentor can go to,
+        # either as one number for all or as a dictionary by detailed site
+        # name / mentor name (missing entries use 1)
+        # Outputs: dictionary of detailed site name -> assigned mentors
+        # Assigns as many mentors as possible within those limits using the
+        # matches from matchFromCSV(). With minCost, among all maximum
+        # assignments one with the fewest total commuting minutes is chosen.
+        sites = [site for site in self.matchDictionary if site != "      "]
+        mentors = sorted(set().union(*[self.matchDictionary[site] for site in sites]))
+        mentorNode = {mentor: 2 + index for index, mentor in enumerate(mentors)}
+        siteNode = {site: 2 + len(mentors) + index for index, site in enumerate(sites)}
+        # Flow runs from the sites to the mentors so that each search starts
+        # from the few sites being added rather than from every free mentor
+        network = FlowNetwork(2 + len(mentors) + len(sites))
+        source, sink = 0, 1
+        totalLoad = 0
+        for mentor in mentors:
+            load = mentorLoad.get(mentor, 1) if isinstance(mentorLoad, dict) else mentorLoad
+            network.addEdge(mentorNode[mentor], sink, load)
+            totalLoad += load
+        assignmentEdges = []
+        for site in sites:
+            for mentor in sorted(self.matchDictionary[site]):
+                edge = network.addEdge(siteNode[site], mentorNode[mentor], 1)
+                assignmentEdges.append((edge, site, mentor))
+
+        # Every unit of flow through a site costs that site's commute, so
+        # adding sites cheapest first and augmenting after each group gives
+        # a minimum-cost maximum assignment (the sites form a matroid). For
+        # the same reason a slot left empty after its group can never be
+        # filled later, so it is closed to keep later searches small.
+        if minCost:
+            costs = sorted(set(self.siteCommutes.get(site, 0) for site in sites))
+        else:
+            costs = [None]
+        flow = 0
+        for cost in costs:
+            if flow == totalLoad: # Every mentor is fully assigned
+                break
+            siteEdges = []
+            for site in sites:
+                if cost == None or self.siteCommutes.get(site, 0) == cost:
+                    capacity = (siteCapacity.get(site, 1)
+                                if isinstance(siteCapacity, dict) else siteCapacity)
+                    siteEdges.append(network.addEdge(source, siteNode[site], capacity))
+            flow += network.maxFlow(source, sink)
+            for edge in siteEdges:
+                network.capacity[edge] = 0
+
+        assignments = {site: [] for site in sites}
+        for edge, site, mentor in assignmentEdges:
+            if network.capacity[edge] == 0: # Edge is used
+                assignments[site].append(mentor)
+        totalCommute = sum(self.siteCommutes.get(site, 0) * len(assigned)
+                           for site, assigned in assignments.items())
+        self.logger.info("%d assignments made (%d commuting minutes in total).",
+                         flow, totalCommute, extra={"event": "assigned"})
+        self.assignments = assignments
+        if writeAssignments:
+            iCal.writeColumns(rootPath + "Assignments.csv", sites,
+                              [assignments[site] for site in sites])
+        return assignments
+
+    def coverTeams(self, site, headcount=1, maxTeam=3, limit=10):
+        # Inputs: Site record, mentors needed in every interval of its
+        # (commute-widened) window, largest team size tried and most teams
+        # listed
+        # Outputs: Team record with the smallest number of mentors whose
+        # free intervals together give every interval of the window at
+        # least headcount mentors (size None if more than maxTeam are needed)
+        window = site.mask
+        # Mentors with the same free intervals in the window are one class;
+        # the search picks classes, members are only filled in at the end
+        classes = {}
+        for mentor, busy in zip(self.mentorNames, self.busyMasks[site.day]):
+            free = window & ~busy
+            if free:
+                classes.setdefault(free, []).append(mentor)
+        masks = sorted(classes, key=lambda free: (-bin(free).count("1"), free))
+        sizes = [len(classes[free]) for free in masks]
+        # reach[i][k - 1]: intervals that classes i, i + 1, ... could give k
+        # mentors, as bitsets (layer k holds the intervals covered k times)
+        reach = [[0] * headcount for i in range(len(masks) + 1)]
+        for i in range(len(masks) - 1, -1, -1):
+            layers = list(reach[i + 1])
+            for copy in range(min(sizes[i], headcount)):
+                layers = iCal.addLayer(layers, masks[i])
+            reach[i] = layers
+
+        best = [maxTeam, []] # Team size to beat, class choices of that size
+        chosen = [] # Class indices of the current partial team
+
+        def search(start, layers):
+            # layers[k - 1]: intervals that the chosen mentors cover k times
+            missing = sum(1 for layer in layers if layer != window)
+            if missing == 0:
+                if len(chosen) < best[0]:
+                    best[0], best[1] = len(chosen), []
+                best[1].append(list(chosen))
+                return
+            # Every interval covered fewer than headcount times needs one
+            # more mentor per missing layer
+            if len(chosen) + missing > best[0] or start == len(masks):
+                return
+            # Could the remaining classes still finish the job?
+            coverable = layers[headcount - 1] | (window & reach[start][headcount - 1])
+            for k in range(1, headcount):
+                coverable |= layers[k - 1] & reach[start][headcount - k - 1]
+            if coverable != window:
+                return
+            for i in range(start, len(masks)):
+                if chosen.count(i) == sizes[i]:
+                    continue
+                added = iCal.addLayer(layers, masks[i])
+                if added == layers: # Adds nothing that is still needed
+                    continue
+                chosen.append(i)
+                search(i, added) # i again: a class can give several mentors
+                chosen.pop()
+
+        search(0, [0] * headcount)
+        if not best[1]:
+            return Team(site.label, headcount, None, 0, [])
+
+        def members(counts):
+            # Outputs: generator of mentor lists, one combination of members
+            # per (class, count) pair, built lazily: a class can hold
+            # hundreds of mentors, too many combinations to list them all
+            if not counts:
+                yield []
+                return
+            (i, count), rest = counts[0], counts[1:]
+            for part in combinations(classes[masks[i]], count):
+                for others in members(rest):
+                    yield list(part) + others
+
+        teams, teamCount = [], 0
+        for choice in best[1]:
+            counts = [(i, choice.count(i)) for i in sorted(set(choice))]
+            total = 1
+            for i, count in counts:
+                total *= comb(sizes[i], count)
+            teamCount += total
+            for team in islice(members(counts), limit - len(teams)):
+                teams.append(sorted(team))
+        teams.sort()
+        return Team(site.label, headcount, best[0], teamCount, teams)
+
+    def addLayer(layers, free):
+        # Outputs: coverage layers (see coverTeams()) after adding one
+        # mentor free in the intervals of free; counts stop at len(layers)
+        layers = list(layers)
+        for k in range(len(layers) - 1, 0, -1):
+            layers[k] |= layers[k - 1] & free
+        layers[0] |= free
+        return layers
+
+    def findTeams(self, headcount=1, maxTeam=3, limit=10, writeTeams=True):
+        # Inputs: mentors needed at once per site, either as one number for
+        # all or as a dictionary by detailed site name (missing entries use
+        # 1), largest team size tried and most teams listed per site
+        # Outputs: dictionary of detailed site name -> Team for every site
+        # of the last matchFromCSV(); also written to Team Matches.csv
+        # with one row per team
+        self.teams = {}
+        for site in self.sites:
+            if site.label == "      ": # Contingency placeholder
+                continue
+            needed = headcount.get(site.label, 1) if isinstance(headcount, dict) else headcount
+            self.teams[site.label] = iCal.coverTeams(self, site, needed, maxTeam, limit)
+            team = self.teams[site.label]
+            if team.size == None:
+                self.logger.info("No team of up to %d mentors covers %s", maxTeam,
+                                 site.label, extra={"event": "noTeam", "site": site.label})
+            else:
+                self.logger.info("%s: %d team(s) of %d", site.label, team.count, team.size,
+                                 extra={"event": "teamsFound", "site": site.label})
+        if writeTeams:
+            with open(rootPath + "Team Matches.csv", 'w', newline='') as csvfile:
+                teamWriter = csv.writer(csvfile)
+                teamWriter.writerow(["Site", "Headcount", "Team size", "Teams", "Team"])
+                for label, team in self.teams.items():
+                    size = "" if team.size == None else team.size
+                    for members in team.teams or [None]:
+                        teamWriter.writerow([label, team.headcount, size, team.count,
+                                             "" if members == None else " + ".join(members)])
+        return self.teams
+
+    def setSiteMatches(self, site, mentors):
+        # Stores the mentors matched with a site in matchDictionary and keeps
+        # the reverse mentor -> sites index (mentorSites) in step with it
+        for mentor in self.matchDictionary.get(site, ()):
+            self.mentorSites[mentor].discard(site)
+        self.matchDictionary[site] = set(mentors)
+        for mentor in mentors:
+            self.mentorSites.setdefault(mentor, set()).add(site)
 
     def findSites(self, mentor):
+        # Outputs: set of detailed site names the mentor can be matched with
+        match = set()
         if mentor not in self.validMentorName:
-            print("Invalid mentor name entered:", mentor)
+            self.logger.warning("Invalid mentor name entered: %s", mentor,
+                                extra={"event": "invalidMentor", "mentor": mentor})
         else:
-            match = set()
-            for key in self.matchDictionary:
-                if mentor in self.matchDictionary[key]:
-                    match.add(key)
+            match = set(self.mentorSites.get(mentor, ()))
             for site in match:
-                sleep(.1)
-                print(site)
+                self.logger.info(site, extra={"event": "siteFound", "mentor": mentor,
+                                              "site": site})
             if len(match) == 0: 
-                print(mentor, "cannot be matched with any sites.")
\ No newline at end of file
+                self.logger.info("%s cannot be matched with any sites.", mentor,
+                                 extra={"event": "noSites", "mentor": mentor})
+        return match
+
+    def findSitesForAll(self, writeSites=False):
+        # Outputs: dictionary of every valid mentor -> set of detailed site
+        # names. If writeSites is True, also writes Mentor Matches.csv with
+        # one row per mentor: the name followed by their sites.
+        allSites = {}
+        for mentor in sorted(self.validMentorName):
+            allSites[mentor] = set(self.mentorSites.get(mentor, ()))
+        if writeSites:
+            currentPath = rootPath + "Mentor Matches.csv"
+            with open(currentPath, 'w', newline='') as csvfile:
+                mentorWriter = csv.writer(csvfile)
+                for mentor, sites in allSites.items():
+                    mentorWriter.writerow([mentor] + sorted(sites))
+        return allSites
+
+
+# Command line: python scheduler.py [paths] SUBCOMMAND ...
+#   ingest                 read every iCal, match the sites and save a snapshot
+#   export --csv --xlsx    write the weekday CSVs and/or the XLSX
+#   match                  write Matches.csv (--assign N also Assignments.csv,
+#                          --teams N also Team Matches.csv)
+#   find-sites NAME        print the sites a mentor can go to
+#   bench ...              run benchmark.py with the remaining arguments
+# --icals DIR and --root DIR replace iCalPath and rootPath. Every subcommand
+# but ingest starts from the snapshot that ingest and match save, and only
+# reads the iCals if there is no valid one. Exit status: 0 on success, 1 if
+# find-sites does not know the mentor (or a bench check fails), 2 on usage
+# errors.
+
+def loadState(a, workers, refresh=False):
+    # Fills a from the snapshot or, if refresh or there is none, from the
+    # iCals (matching the sites too if there is a site file)
+    if not refresh and iCal.loadSnapshot(a):
+        return
+    iCal.read(a, workers)
+    try:
+        iCal.matchFromCSV(a, writeMatches=False)
+    except FileNotFoundError:
+        a.logger.warning("No site file found, sites not matched.",
+                         extra={"event": "noSiteFile"})
+    iCal.saveSnapshot(a)
+
+def main(arguments=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="scheduler.py",
+                                     description="Moneythink mentor scheduler")
+    parser.add_argument("--icals", metavar="DIR", help="directory of the iCals")
+    parser.add_argument("--root", metavar="DIR",
+                        help="directory of the site file, exports, cache and snapshot")
+    parser.add_argument("--output", choices=["verbose", "progress", "silent"],
+                        default="progress")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse the iCals (0 = every core)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ingest", help="read every iCal and save a snapshot")
+    export = subparsers.add_parser("export", help="write the schedules")
+    export.add_argument("--csv", action="store_true", help="Monday.csv ... Friday.csv")
+    export.add_argument("--long", metavar="FILE",
+                        help="with --csv, also one (mentor, day, interval, free) row per interval")
+    export.add_argument("--xlsx", nargs="?", const="Moneythink Schedules Tabulation.xlsx",
+                        metavar="FILE", help="XLSX workbook (in --root unless absolute)")
+    match = subparsers.add_parser("match", help="write Matches.csv")
+    match.add_argument("--assign", type=int, metavar="N",
+                       help="also assign up to N mentors per site to Assignments.csv")
+    match.add_argument("--min-cost", action="store_true",
+                       help="with --assign, keep total commuting time minimal")
+    match.add_argument("--teams", type=int, metavar="N",
+                       help="also write Team Matches.csv: smallest groups that give "
+                            "every interval of a site N mentors")
+    match.add_argument("--max-team", type=int, default=3, metavar="SIZE",
+                       help="with --teams, largest group tried (default 3)")
+    findSites = subparsers.add_parser("find-sites", help="print a mentor's sites")
+    findSites.add_argument("name")
+    subparsers.add_parser("bench", help="run benchmark.py (see its --help)",
+                          add_help=False)
+    options, rest = parser.parse_known_args(arguments)
+    if options.command == "bench":
+        import benchmark
+        return benchmark.main(rest)
+    if rest:
+        parser.error("unrecognized arguments: %s" % " ".join(rest))
+
+    setPaths(options.icals, options.root)
+    a = iCal(output=options.output)
+    workers = options.workers or None
+    if options.command == "ingest":
+        loadState(a, workers, refresh=True)
+    elif options.command == "export":
+        if not options.csv and not options.xlsx:
+            parser.error("export needs --csv and/or --xlsx")
+        loadState(a, workers)
+        if options.csv:
+            iCal.writeToCSV(a, longPath=options.long and join(rootPath, options.long))
+        if options.xlsx:
+            iCal.writeToXLSX(a, join(rootPath, options.xlsx))
+    elif options.command == "match":
+        loadState(a, workers)
+        iCal.matchFromCSV(a)
+        iCal.saveSnapshot(a)
+        if options.assign:
+            iCal.assign(a, siteCapacity=options.assign, minCost=options.min_cost)
+        if options.teams:
+            iCal.findTeams(a, headcount=options.teams, maxTeam=options.max_team)
+    elif options.command == "find-sites":
+        loadState(a, workers)
+        if options.name not in a.mentorIndex:
+            sys.stderr.write("Unknown mentor: %s\n" % options.name)
+            return 1
+        for site in sorted(a.mentorSites.get(options.name, ())):
+            print(site)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# Local JSON query server for scheduler.py, standard library only
+
+# How to use:
+# 1. python server.py (reads every iCal and Site Times Input.csv once, then
+#    serves http://127.0.0.1:8000; --host, --port and --workers change that)
+# 2. Ask it questions, e.g.
+#    /availability?day=Tuesday&start=1530&end=1630  mentors free then
+#      (&commute=15 widens the time on both sides)
+#    /sites?mentor=Jane Doe                         sites a mentor matches
+#    /mentors?site=Perry MONDAY                     mentors matching a site
+#    /mentor?name=Jane Doe                          free times, sites, conflicts
+#    /sites and /mentors without a query list every site / mentor
+# Times in answers are seconds after midnight.
+# Every answer is JSON; errors come back as {"error": message} with a 4xx
+# status. Connections are kept alive, and any number of clients can be
+# served at once.
+# From Python: asyncio.run(server.serve(a)) serves an iCal already loaded.
+
+import argparse
+import asyncio
+import json
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import scheduler
+
+statusText = {200: "OK", 400: "Bad Request", 404: "Not Found",
+              405: "Method Not Allowed"}
+
+class QueryError(Exception):
+    # Raised by the query handlers; answered with status and message
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def parameter(query, name):
+    # Outputs: the single value of a query parameter
+    values = query.get(name)
+    if not values:
+        raise QueryError(400, "Missing parameter: %s" % name)
+    return values[0]
+
+def availability(a, query):
+    try:
+        site = a.makeSites([["", parameter(query, "day"), parameter(query, "start"),
+                             parameter(query, "end"), query.get("commute", ["0"])[0]]],
+                           "query")
+    except ValueError as error:
+        raise QueryError(400, str(error))
+    if len(site) != 1: # Analysis expands to every weekday
+        raise QueryError(400, "Unknown weekday: %s" % parameter(query, "day"))
+    site = site[0]
+    return {"day": a.weekdayNames[site.day], "start": site.start, "end": site.end,
+            "mentors": a.availableMentors(site.day, site.mask)}
+
+def sites(a, query):
+    if "mentor" not in query:
+        return {"sites": [{"site": site.label, "day": a.weekdayNames[site.day],
+                           "start": site.start, "end": site.end,
+                           "commute": site.commute} for site in a.sites]}
+    mentor = parameter(query, "mentor")
+    if mentor not in a.mentorIndex:
+        raise QueryError(404, "Unknown mentor: %s" % mentor)
+    return {"mentor": mentor, "sites": sorted(a.mentorSites.get(mentor, ()))}
+
+def mentors(a, query):
+    if "site" not in query:
+        return {"mentors": sorted(a.mentorNames)}
+    site = parameter(query, "site")
+    if site not in a.matchDictionary:
+        raise QueryError(404, "Unknown site: %s" % site)
+    return {"site": site, "mentors": sorted(a.matchDictionary[site])}
+
+def mentor(a, query):
+    name = parameter(query, "name")
+    index = a.mentorIndex.get(name)
+    if index == None:
+        raise QueryError(404, "Unknown mentor: %s" % name)
+    # Free [start, end] spans of the grid, in seconds after midnight
+    free = {}
+    for day, dayName in enumerate(a.weekdayNames):
+        free[dayName] = a.maskSpans(a.fullMask & ~a.busyMasks[day][index])
+    return {"mentor": name, "free": free, "sites": sorted(a.mentorSites.get(name, ())),
+            "conflicts": a.conflicts.get(name, [])}
+
+handlers = {"/availability": availability, "/sites": sites, "/mentors": mentors,
+            "/mentor": mentor}
+
+def answer(a, method, target):
+    # Outputs: (status, JSON-serialisable body) for one request
+    if method != "GET":
+        return 405, {"error": "Only GET is supported"}
+    parts = urlsplit(target)
+    handler = handlers.get(unquote(parts.path).rstrip("/") or "/")
+    if handler == None:
+        return 404, {"error": "Unknown path: %s" % parts.path,
+                     "paths": sorted(handlers)}
+    try:
+        return 200, handler(a, parse_qs(parts.query))
+    except QueryError as error:
+        return error.status, {"error": str(error)}
+
+async def handleClient(a, reader, writer):
+    # Answers requests on one connection until the client closes it
+    try:
+        while True:
+            requestLine = await reader.readline()
+            if not requestLine:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if "content-length" in headers: # No request needs a body
+                await reader.readexactly(int(headers["content-length"]))
+            words = requestLine.decode("latin-1").split()
+            if len(words) != 3:
+                status, body = 400, {"error": "Malformed request line"}
+                keepAlive = False
+            else:
+                status, body = answer(a, words[0], words[1])
+                keepAlive = (headers.get("connection", "").lower() != "close" and
+                             (words[2] == "HTTP/1.1" or
+                              headers.get("connection", "").lower() == "keep-alive"))
+            payload = json.dumps(body).encode()
+            writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                          "Content-Length: %d\r\nAccess-Control-Allow-Origin: *\r\n"
+                          "Connection: %s\r\n\r\n" % (
+                              status, statusText[status], len(payload),
+                              "keep-alive" if keepAlive else "close")).encode() + payload)
+            await writer.drain()
+            if not keepAlive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(a, host="127.0.0.1", port=8000):
+    # Serves the schedules and matches of a (an iCal after read() and
+    # matchFromCSV()) until cancelled
+    server = await asyncio.start_server(
+        lambda reader, writer: handleClient(a, reader, writer), host, port)
+    a.logger.info("Serving on http://%s:%d", host, port, extra={"event": "serving"})
+    async with server:
+        await server.serve_forever()
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve mentor availability as JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse the iCals (0 = every core)")
+    options = parser.parse_args(arguments)
+
+    a = scheduler.iCal(output="progress")
+    a.read(options.workers or None)
+    try:
+        a.matchFromCSV(writeMatches=False)
+    except FileNotFoundError: # Availability queries still work
+        a.logger.warning("No site file found, sites not matched.",
+                         extra={"event": "noSiteFile"})
+    a.setOutput("verbose")
+    try:
+        asyncio.run(serve(a, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()